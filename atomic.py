@@ -0,0 +1,39 @@
+"""
+
+atomic.py
+~~~~~~~~~
+
+Write files so that readers never see them half-written.
+
+© Lukas Juhrich.
+
+"""
+import json
+import os
+
+
+def write_atomically(filename, write, mode='w'):
+    """Write a file through a temporary file renamed over it
+
+    The temporary file is synced to disk before the rename, so that
+    after a crash there is either the old or the new file.
+
+    :param str filename: The file to write
+    :param write: A callable writing the content to the stream it is
+        passed
+    :param str mode: The mode to open the temporary file in
+    """
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, mode) as stream:
+        write(stream)
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def dump_json(data, filename, **kwargs):
+    """Atomically write ``data`` as JSON
+
+    The keyword arguments are passed to ``json.dump``.
+    """
+    write_atomically(filename, lambda stream: json.dump(data, stream, **kwargs))
@@ -0,0 +1,141 @@
+"""
+
+attachment_store.py
+~~~~~~~~~~~~~~~~~~~
+
+© Lukas Juhrich.
+
+"""
+import json
+import os
+import shutil
+from datetime import datetime
+from tempfile import NamedTemporaryFile
+
+from atomic import dump_json
+
+
+STORE_FOLDER_NAME = '.attachments'
+MANIFEST_FILENAME = '.submissions.json'
+
+
+class AttachmentStore:
+    """A content-addressed store of decoded attachments.
+
+    Every attachment is stored once under its sha256 hex digest and
+    hard-linked into the ``person/round`` folders.  The objects are
+    read-only, so editors replace a linked file instead of modifying
+    every copy at once.
+    """
+    def __init__(self, root=STORE_FOLDER_NAME):
+        self.root = root
+
+    def object_path(self, checksum):
+        """Return the path of the object with the given checksum"""
+        return os.path.join(self.root, checksum[:2], checksum)
+
+    def temporary_file(self):
+        """Open a temporary file to be passed to :py:meth:`add` later
+
+        :rtype: NamedTemporaryFile
+        """
+        os.makedirs(self.root, exist_ok=True)
+        return NamedTemporaryFile('wb', dir=self.root, prefix='.', suffix='.part',
+                                  delete=False)
+
+    def add(self, filename, checksum, mode=0o444):
+        """Move a file into the store unless it is already present
+
+        :param str filename: The file to move, e.g. from
+            :py:meth:`temporary_file`.  It is removed if the object
+            already exists.
+        :param str checksum: The sha256 hex digest of the file
+        :param int mode: The permissions of a new object
+
+        :returns: Whether the object was new
+        :rtype: bool
+        """
+        path = self.object_path(checksum)
+        if os.path.exists(path):
+            os.unlink(filename)
+            return False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(filename, mode)
+        os.replace(filename, path)
+        return True
+
+    def link(self, checksum, target):
+        """Atomically put the object with the given checksum at ``target``
+
+        A hard link is used where possible, a copy otherwise.
+        Nothing is done if ``target`` already is that object.
+
+        :param str checksum: The sha256 hex digest of the object
+        :param str target: The path to link the object to
+        """
+        path = self.object_path(checksum)
+        if os.path.exists(target) and os.path.samefile(path, target):
+            return
+
+        tmp_target = os.path.join(os.path.dirname(target),
+                                  ".{}.link".format(os.path.basename(target)))
+        try:
+            os.unlink(tmp_target)
+        except FileNotFoundError:
+            pass
+
+        try:
+            os.link(path, tmp_target)
+        except OSError:
+            shutil.copyfile(path, tmp_target)
+        os.replace(tmp_target, target)
+
+
+class SubmissionManifest:
+    """The record of which mail every file of a ``person/round`` came from.
+
+    For each filename, all submitted versions are stored with their
+    checksum, the key of the mail and its date.  The latest version
+    wins, regardless of the order the mails have been saved in.
+    """
+    def __init__(self, path):
+        self.filename = os.path.join(path, MANIFEST_FILENAME)
+        try:
+            with open(self.filename) as stream:
+                self.files = json.load(stream)
+        except FileNotFoundError:
+            self.files = {}
+
+    def _write_manifest(self):
+        """Atomically dump the manifest to :py:attr:`filename`"""
+        dump_json(self.files, self.filename, indent=2, sort_keys=True)
+
+    def record(self, filename, checksum, mail_key, date):
+        """Add a version of a file and write the manifest
+
+        :param str filename: The name of the file
+        :param str checksum: The sha256 hex digest of the version
+        :param str mail_key: The key of the mail, see
+            :py:func:`mail.mail_key`
+        :param datetime date: The date of the mail
+        """
+        versions = self.files.setdefault(filename, [])
+        version = {'checksum': checksum, 'mail': mail_key, 'date': date.isoformat()}
+        if version not in versions:
+            versions.append(version)
+            versions.sort(key=lambda v: v['date'])
+            self._write_manifest()
+
+    def latest(self, filename):
+        """Return the latest version of a file
+
+        :returns: A dict containing ``checksum``, ``mail`` and ``date``
+            or ``None`` if the file is unknown
+        """
+        versions = self.files.get(filename)
+        if not versions:
+            return None
+        latest = dict(versions[-1])
+        latest['date'] = datetime.fromisoformat(latest['date'])
+        return latest
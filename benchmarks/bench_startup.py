@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+
+bench_startup.py
+~~~~~~~~~~~~~~~~
+
+Measure how long ``grade.py`` takes to start and run cheap
+subcommands, since it is called from shell loops.
+
+Usage: ``python benchmarks/bench_startup.py [--runs N] [--max-ms MS]``
+
+© Lukas Juhrich.
+
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRADE = os.path.join(REPO, 'grade.py')
+
+SAMPLE_CONFIG = """\
+persons:
+  anna: anna@example.org
+  bert: bert@example.org
+rounds:
+  uebung01:
+    opened: 2016-10-10 16:40:28
+"""
+
+SCENARIOS = {
+    'import': [sys.executable, '-c', 'import grade'],
+    'invalid command': [sys.executable, GRADE, 'nonexistent'],
+    'grades': [sys.executable, GRADE, 'grades'],
+}
+
+
+def time_command(command, cwd, runs):
+    """Run a command ``runs`` times and return the wall times in ms"""
+    env = dict(os.environ, PYTHONPATH=REPO)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, check=False)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup of grade.py.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float,
+                        help="Fail if the median of a scenario exceeds this")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as course:
+        with open(os.path.join(course, '.grade'), 'w') as stream:
+            stream.write(SAMPLE_CONFIG)
+
+        baseline = median(time_command([sys.executable, '-c', 'pass'], course, args.runs))
+        print("{: <20}{: >10.1f} ms".format("python itself", baseline))
+
+        failed = False
+        for name, command in SCENARIOS.items():
+            result = median(time_command(command, course, args.runs))
+            print("{: <20}{: >10.1f} ms".format(name, result))
+            failed |= args.max_ms is not None and result > args.max_ms
+
+    if failed:
+        print("Startup slower than {} ms!".format(args.max_ms))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+
+bench_suite.py
+~~~~~~~~~~~~~~
+
+Time the main code paths of the grading scripts on a generated mbox
+and course tree, and store the results as JSON so that runs can be
+compared over time.
+
+Usage: ``python benchmarks/bench_suite.py [--mails N] [--persons N]
+[--rounds N] [--runs N] [--only NAME ...] [--output FILE]
+[--compare FILE]``
+
+© Lukas Juhrich.
+
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from statistics import median
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+# pylint: disable=wrong-import-position
+from generators import generate_course, generate_mbox
+from config import CONFIG_FILENAME, GradingConfig
+from mail import MailIndex, decode_attachment, iter_message_attachments, message_cache, \
+    read_message, save_attachment
+from mail_commands import print_mail
+from marks import GRADE_CACHE_FILENAME, GradeCache
+from send_mail import RoundMessageBuilder
+
+
+class Course:
+    """The generated data the scenarios work on"""
+    def __init__(self, path, args):
+        self.path = path
+        self.mbox = os.path.join(path, 'Inbox')
+        self.index_filename = os.path.join(path, '.grade-index')
+        self.mbox_size = generate_mbox(self.mbox, args.mails, persons=args.persons,
+                                       seed=args.seed)
+        self.persons, self.rounds = generate_course(path, args.persons, args.rounds,
+                                                    seed=args.seed)
+
+    def index(self):
+        index = MailIndex(self.mbox, filename=self.index_filename)
+        index.update()
+        return index.mails
+
+
+def _remove(filename):
+    try:
+        os.unlink(filename)
+    except FileNotFoundError:
+        pass
+
+
+def bench_index_cold(course):
+    _remove(course.index_filename)
+    course.index()
+
+
+def bench_list(course):
+    with redirect_stdout(io.StringIO()):
+        for i, mail in enumerate(course.index()):
+            print_mail(i, mail)
+
+
+def bench_show(course):
+    message_cache.clear()
+    mails = course.index()
+    with redirect_stdout(io.StringIO()):
+        for mail in mails[::max(1, len(mails) // 50)]:
+            for attachment in iter_message_attachments(message_cache.get(mail, course.mbox)):
+                print(decode_attachment(attachment))
+
+
+def bench_save(course):
+    target = os.path.join(course.path, 'saved')
+    shutil.rmtree(target, ignore_errors=True)
+    shutil.rmtree(os.path.join(course.path, '.attachments'), ignore_errors=True)
+    os.mkdir(target)
+    with redirect_stdout(io.StringIO()):
+        for i, mail in enumerate(course.index()):
+            path = os.path.join(target, str(i % len(course.persons)))
+            os.makedirs(path, exist_ok=True)
+            for attachment in iter_message_attachments(read_message(mail, course.mbox)):
+                save_attachment(attachment, path, mail=mail)
+
+
+def bench_grades_cold(course):
+    _remove(GRADE_CACHE_FILENAME)
+    bench_grades_warm(course)
+
+
+def bench_grades_warm(course):
+    cache = GradeCache()
+    cache.sync(course.persons, course.rounds)
+    cache.grade_sums()
+    cache.connection.close()
+
+
+def bench_config(course):
+    filename = CONFIG_FILENAME + '-bench'
+    shutil.copy(CONFIG_FILENAME, filename)
+    config = GradingConfig(filename)
+    with config.batch():
+        for i in range(50):
+            config.add_person("late{:02d}".format(i), "late{:02d}@example.org".format(i))
+    for i in range(20):
+        config.mark_processed(["<{}@bench>".format(i)])
+
+
+def bench_render(course):
+    builder = RoundMessageBuilder(course.rounds[-1])
+    for person in course.persons:
+        if os.path.isdir(os.path.join(person, course.rounds[-1])):
+            builder.write(person, "{}@example.org".format(person), io.BytesIO())
+
+
+SCENARIOS = {
+    'index (cold)': bench_index_cold,
+    'list': bench_list,
+    'show': bench_show,
+    'save': bench_save,
+    'grades (cold)': bench_grades_cold,
+    'grades (warm)': bench_grades_warm,
+    'config': bench_config,
+    'render': bench_render,
+}
+
+
+def run_scenario(function, course, runs):
+    """Run a scenario ``runs`` times after a warm-up
+
+    :returns: The wall times in ms
+    :rtype: list
+    """
+    function(course)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function(course)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+                              ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, previous):
+    print("\n{: <20}{: >10}{: >10}{: >8}".format("compared to", "before", "now", "ratio"))
+    for name, result in results.items():
+        if name not in previous:
+            continue
+        before, now = previous[name]['median'], result['median']
+        print("{: <20}{: >10.1f}{: >10.1f}{: >8.2f}".format(name, before, now, now / before))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the grading scripts.")
+    parser.add_argument("--mails", type=int, default=500)
+    parser.add_argument("--persons", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--only", nargs='+', choices=SCENARIOS, metavar='NAME',
+                        help="Run only these scenarios")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with the results in this JSON file")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as path:
+        os.chdir(path)
+        try:
+            course = Course(path, args)
+            print("{} mails ({:.1f} MiB), {} persons, {} rounds"
+                  .format(args.mails, course.mbox_size / 2 ** 20, args.persons, args.rounds))
+            results = {}
+            for name in args.only or SCENARIOS:
+                timings = run_scenario(SCENARIOS[name], course, args.runs)
+                results[name] = {'median': median(timings), 'min': min(timings),
+                                 'runs': timings}
+                print("{: <20}{: >10.1f} ms".format(name, results[name]['median']))
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {key: getattr(args, key)
+                       for key in ('mails', 'persons', 'rounds', 'seed', 'runs')},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(report, stream, indent=2)
+    if args.compare:
+        with open(args.compare) as stream:
+            print_comparison(results, json.load(stream)['results'])
+
+
+if __name__ == '__main__':
+    main()
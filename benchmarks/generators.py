@@ -0,0 +1,172 @@
+"""
+
+generators.py
+~~~~~~~~~~~~~
+
+Generate synthetic Thunderbird mailboxes and course trees for the
+benchmarks.  Everything is seeded, so that runs are comparable.
+
+© Lukas Juhrich.
+
+"""
+import os
+import random
+from datetime import datetime, timedelta
+from email.header import Header
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from yaml import safe_dump
+
+from config import CONFIG_FILENAME, GLOBAL_FILENAME, GLOBAL_FOLDER_NAME, GLOBAL_MAIL_NAME, \
+    GRADING_FILENAME
+from mail import DATE_FORMAT
+
+START_DATE = datetime(2016, 10, 10, 16, 40, 28)
+# Attachment sizes follow a log-normal distribution around this median
+ATTACHMENT_MEDIAN = 8 * 1024
+ATTACHMENT_SIGMA = 1.5
+ATTACHMENT_MAX = 4 * 1024 * 1024
+
+WORDS = ("Abgabe", "Übung", "Lösung", "Aufgabe", "Fehler", "Programm", "Schleife",
+         "Funktion", "Ausgabe", "Größe", "naïve", "résumé", "test", "python")
+
+
+def person_name(i):
+    return "student{:04d}".format(i)
+
+
+def person_address(i):
+    return "{}@example.org".format(person_name(i))
+
+
+def round_name(j):
+    return "uebung{:02d}".format(j + 1)
+
+
+def _text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)) + "\n"
+
+
+def _attachment_size(rng, median=ATTACHMENT_MEDIAN):
+    size = int(rng.lognormvariate(0, ATTACHMENT_SIGMA) * median)
+    return max(16, min(size, ATTACHMENT_MAX))
+
+
+def generate_message(rng, i, persons, attachments=2, median=ATTACHMENT_MEDIAN):
+    """Generate a submission with a text part and some attachments
+
+    The encodings are mixed: text in us-ascii, latin-1 and utf-8,
+    encoded as 7bit, quoted-printable and base64, and binary
+    attachments in base64.
+
+    :rtype: MIMEMultipart
+    """
+    sender = rng.randrange(persons)
+    message = MIMEMultipart()
+    message['From'] = "Student {} <{}>".format(sender, person_address(sender))
+    message['To'] = "Tutor <tutor@example.org>"
+    message['Subject'] = Header("Abgabe Übung {}".format(i % 12 + 1), 'utf-8')
+    message['Message-ID'] = "<{}@generated.example.org>".format(i)
+
+    charset = rng.choice(('us-ascii', 'latin-1', 'utf-8'))
+    text = _text(rng, 40)
+    if charset == 'us-ascii':
+        text = text.encode('ascii', 'replace').decode()
+    message.attach(MIMEText(text, 'plain', charset))
+
+    for k in range(rng.randrange(attachments + 1)):
+        size = _attachment_size(rng, median)
+        if rng.random() < 0.5:
+            # source code, sent as text
+            lines = (size // 60) + 1
+            part = MIMEText("".join("print({!r})\n".format(_text(rng, 4)[:-1])
+                                    for _ in range(lines)), 'x-python', 'utf-8')
+            name = "aufgabe{}.py".format(k + 1)
+        else:
+            part = MIMEApplication(rng.getrandbits(8 * size).to_bytes(size, 'little'))
+            name = "screenshot{}.png".format(k + 1)
+        part.add_header('Content-Disposition', 'attachment', filename=name)
+        message.attach(part)
+    return message
+
+
+def generate_mbox(path, count, persons=100, seed=0, attachments=2,
+                  median=ATTACHMENT_MEDIAN):
+    """Write a Thunderbird mbox with ``count`` submissions
+
+    Every mail is preceded by a ``From - `` separator with a date in
+    :py:data:`mail.DATE_FORMAT`, a few minutes after the last one.
+
+    :param str path: The mbox file to write
+    :param int count: The number of mails
+    :param int persons: The number of distinct senders
+    :param int attachments: The maximum number of attachments per mail
+    :param int median: The median attachment size in bytes
+
+    :returns: The size of the mbox
+    :rtype: int
+    """
+    rng = random.Random(seed)
+    date = START_DATE
+    with open(path, 'wb') as stream:
+        for i in range(count):
+            date += timedelta(seconds=rng.randrange(60, 3600))
+            stream.write("From - {}\r\n".format(date.strftime(DATE_FORMAT)).encode())
+            stream.write(b"X-Mozilla-Status: 0001\r\nX-Mozilla-Status2: 00000000\r\n")
+            content = generate_message(rng, i, persons, attachments, median).as_bytes()
+            stream.write(content.replace(b'\n', b'\r\n'))
+            stream.write(b"\r\n")
+        return stream.tell()
+
+
+def _grading(rng):
+    total = rng.randrange(8, 16)
+    given = rng.randrange(total + 1)
+    extra = "+{}".format(rng.randrange(3)) if rng.random() < 0.3 else ""
+    return "* Bewertung\n{}\n* Ergebnis\n\n#+BEGIN_RESULT\n{}{}/{}+2\n#+END_RESULT\n".format(
+        _text(rng, 30), given, extra, total)
+
+
+def generate_course(path, persons, rounds, seed=0, submission_rate=0.9):
+    """Create a course folder with ``.grade`` and grading files
+
+    All rounds but the last one are closed.  Every person submitted to
+    a round with the probability ``submission_rate``.
+
+    :param str path: The course folder, created if necessary
+    :param int persons: The number of persons
+    :param int rounds: The number of rounds
+
+    :returns: The names of the persons and of the rounds
+    :rtype: tuple
+    """
+    rng = random.Random(seed)
+    person_names = [person_name(i) for i in range(persons)]
+    round_names = [round_name(j) for j in range(rounds)]
+
+    config_dict = {'persons': {person_name(i): person_address(i) for i in range(persons)},
+                   'rounds': {}}
+    for j, round_ in enumerate(round_names):
+        opened = START_DATE + timedelta(weeks=j)
+        config_dict['rounds'][round_] = {'opened': opened}
+        if j < rounds - 1:
+            config_dict['rounds'][round_]['closed'] = opened + timedelta(weeks=1)
+
+        os.makedirs(os.path.join(path, GLOBAL_FOLDER_NAME, round_), exist_ok=True)
+        for name in (GLOBAL_MAIL_NAME, GLOBAL_FILENAME):
+            with open(os.path.join(path, GLOBAL_FOLDER_NAME, round_, name), 'w') as stream:
+                stream.write(_text(rng, 200))
+
+    for person in person_names:
+        for round_ in round_names:
+            if rng.random() >= submission_rate:
+                continue
+            os.makedirs(os.path.join(path, person, round_), exist_ok=True)
+            with open(os.path.join(path, person, round_, GRADING_FILENAME), 'w') as stream:
+                stream.write(_grading(rng))
+
+    with open(os.path.join(path, CONFIG_FILENAME), 'w') as stream:
+        safe_dump(config_dict, stream, default_flow_style=False)
+    return person_names, round_names
@@ -1,12 +1,28 @@
+import fcntl
 import os
 import shutil
-import subprocess
+from contextlib import contextmanager
+from copy import deepcopy
 from datetime import datetime
 
-from yaml import dump, load
+from yaml import dump, dump_all, load, load_all
+
+from atomic import write_atomically
+from repository import GitRepository
+from timings import count, span
+try:
+    from yaml import CSafeDumper as Dumper, CSafeLoader as Loader
+except ImportError:
+    from yaml import SafeDumper as Dumper, SafeLoader as Loader
 
 CONFIG_FILENAME = '.grade'
+LOCK_SUFFIX = '.lock'
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_END = '\n...\n'
+# Compact the journal into the snapshot after this many operations
+JOURNAL_COMPACT_AFTER = 200
 GRADING_FILENAME = 'grading.org'
+TEMPLATE_JOBS = 8
 GRADING_TEMPLATE = """\
 # -*- mode: org; -*-
 
@@ -42,21 +58,163 @@ class GradingConfig:
     """A class representing the YML config.
 
     Perhaps to be used as a singleton.
+
+    Every mutation is done through :py:meth:`_set` inside of a
+    :py:meth:`batch`, which holds a lock on the config, reloads it and
+    writes all changes at once in the end.  If ``journal: true`` is set
+    in the config, the changes are appended to a journal instead of
+    rewriting the snapshot, and the journal is compacted into the
+    snapshot every :py:data:`JOURNAL_COMPACT_AFTER` operations.
+
+    Files created for a round are staged using :py:attr:`repository`.
     """
     def __init__(self, filename=CONFIG_FILENAME):
         self.filename = filename
-        self.config_dict = self._load_yml_config(filename)
+        self.repository = GitRepository()
+        self.lock_filename = filename + LOCK_SUFFIX
+        self.journal_filename = filename + JOURNAL_SUFFIX
+        self.journal_length = 0
+        self._batch_depth = 0
+        self._pending = []
+        self.config_dict = self._load_config()
 
     @staticmethod
     def _load_yml_config(filename):
-        """Parse a file as yml and return the python object"""
-        with open(filename) as stream:
-            return load(stream)
+        """Parse a file as yml and return the python object
+
+        A missing file is treated like an empty one.
+        """
+        try:
+            with span('config.load'), open(filename) as stream:
+                count('files opened')
+                return load(stream, Loader=Loader) or {}
+        except FileNotFoundError:
+            return {}
+
+    def _load_config(self):
+        """Load the snapshot and replay the journal on top of it"""
+        config_dict = self._load_yml_config(self.filename)
+        self.journal_length = 0
+        try:
+            with open(self.journal_filename) as stream:
+                journal = stream.read()
+        except FileNotFoundError:
+            return config_dict
+
+        # ignore an operation that is still being written
+        end = journal.rfind(JOURNAL_END)
+        journal = journal[:end + len(JOURNAL_END)] if end >= 0 else ''
+        with span('config.journal'):
+            for path, value in load_all(journal, Loader=Loader):
+                config_dict = self._apply(config_dict, path, value)
+                self.journal_length += 1
+        return config_dict
+
+    @staticmethod
+    def _apply(config_dict, path, value):
+        """Set the value at a key path of a config dict
+
+        :returns: The modified config dict
+        """
+        if not path:
+            return value
+        target = config_dict
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = value
+        return config_dict
+
+    def _set(self, path, value):
+        """Set the value at a key path, e.g. ``('persons', name)``
+
+        Must be called inside of :py:meth:`batch`.
+        """
+        assert self._batch_depth, "Config modified outside of a batch"
+        self.config_dict = self._apply(self.config_dict, path, value)
+        self._pending.append([list(path), deepcopy(value)])
+
+    @contextmanager
+    def _locked(self):
+        """Hold an exclusive lock on the config"""
+        with open(self.lock_filename, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @contextmanager
+    def batch(self):
+        """Coalesce all changes into one transaction
+
+        The config is locked and reloaded, so concurrent invocations
+        cannot clobber each other.  The changes are written once when
+        the outermost batch is left, and discarded if it is left
+        through an exception.
+        """
+        if self._batch_depth:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+            return
+
+        with self._locked():
+            self.config_dict = self._load_config()
+            snapshot = deepcopy(self.config_dict)
+            self._batch_depth = 1
+            try:
+                yield self
+            except BaseException:
+                self.config_dict = snapshot
+                raise
+            else:
+                self._commit()
+            finally:
+                self._batch_depth = 0
+                self._pending = []
+
+    def _commit(self):
+        """Write the pending changes to the journal or the snapshot"""
+        if not self._pending:
+            return
+        if not self.config_dict.get('journal'):
+            self._write_config()
+            return
+
+        with open(self.journal_filename, 'a') as stream:
+            # every operation is a document of its own, terminated by
+            # JOURNAL_END, so that a partial write can be recognized
+            stream.write(dump_all(self._pending, Dumper=Dumper, default_flow_style=False,
+                                  explicit_start=True, explicit_end=True))
+            stream.flush()
+            os.fsync(stream.fileno())
+        self.journal_length += len(self._pending)
+
+        if self.journal_length >= JOURNAL_COMPACT_AFTER:
+            self._write_config()
 
     def _write_config(self):
-        """Dump the config dict to :py:attr:`filename`"""
-        with open(self.filename, 'w') as stream:
-            stream.write(dump(self.config_dict, default_flow_style=False))
+        """Atomically dump the config dict to :py:attr:`filename`
+
+        The journal is merged into the snapshot, so it is removed.
+        """
+        content = dump(self.config_dict, Dumper=Dumper, default_flow_style=False)
+        with span('config.write'):
+            write_atomically(self.filename, lambda stream: stream.write(content))
+
+        try:
+            os.unlink(self.journal_filename)
+        except FileNotFoundError:
+            pass
+        self.journal_length = 0
+
+    def compact(self):
+        """Merge the journal into the snapshot"""
+        with self._locked():
+            self.config_dict = self._load_config()
+            self._write_config()
 
     def create_sample_config(self):
         """Create a sample config and write it.
@@ -66,24 +224,74 @@ class GradingConfig:
         if self.config_dict:
             raise ValueError("Nonempty Config")
 
-        self.config_dict = {'persons': {}, 'rounds': {}}
-        self._write_config()
+        with self.batch():
+            self._set((), {'persons': {}, 'rounds': {}})
 
     def add_person(self, name, email=""):
-        if name in self.config_dict['persons']:
-            print("Person {} already exists, skipping.".format(name))
-
-        self.config_dict['persons'][name] = email
-        self._write_config()
+        with self.batch():
+            if name in self.config_dict['persons']:
+                print("Person {} already exists, skipping.".format(name))
+                return
+            self._set(('persons', name), email)
 
     def delete_persons(self):
-        self.config_dict['persons'] = {}
-        self._write_config()
+        with self.batch():
+            self._set(('persons',), {})
 
+    def add_mailbox(self, path):
+        """Add an mbox file or Maildir directory to read mails from
+
+        Without any, the Thunderbird folder of
+        :py:func:`mail.get_file_path` is used.  Once one is added, only
+        the added ones are read.
+        """
+        with self.batch():
+            mailboxes = self.config_dict.get('mailboxes', [])
+            if path in mailboxes:
+                print("Mailbox {} already added, skipping.".format(path))
+                return
+            self._set(('mailboxes',), mailboxes + [path])
 
     def get_person_mail(self, person):
         return self.config_dict['persons'].get(person)
 
+    def persons_by_address(self):
+        """Build a reverse index of the persons' mail addresses.
+
+        :returns: A dict mapping lowercase addresses to person names
+        :rtype: dict
+        """
+        # imported here, as ``email`` takes long to import for every run
+        from email.utils import getaddresses
+
+        return {address.lower(): person
+                for person, emails in self.config_dict['persons'].items()
+                for _, address in getaddresses([emails or ''])
+                if address}
+
+    def processed_mails(self, round_name=None):
+        """Return the keys of the mails already saved in a round.
+
+        :param str round_name: The round.  Defaults to the current one.
+
+        :rtype: set
+        """
+        data = self.config_dict['rounds'][round_name or self.current_round_name]
+        return set(data.get('processed', []))
+
+    def mark_processed(self, mail_keys, round_name=None):
+        """Record mails as saved in a round and write the config.
+
+        :param mail_keys: An iterable of keys as returned by
+            :py:func:`mail.mail_key`
+        :param str round_name: The round.  Defaults to the current one.
+        """
+        with self.batch():
+            round_name = round_name or self.current_round_name
+            processed = self.config_dict['rounds'][round_name].get('processed', [])
+            self._set(('rounds', round_name, 'processed'),
+                      sorted(set(processed) | set(mail_keys)))
+
     @property
     def open_rounds(self):
         """Determine the number of open rounds.
@@ -114,84 +322,193 @@ class GradingConfig:
 
 
 
-    def add_round(self, round_name):
+    def add_round(self, round_name, jobs=TEMPLATE_JOBS):
         """Add a round given a name.
 
         Write it to the config setting ``opened`` to now.
 
         :param str round_name: The name of the new round
+        :param int jobs: The number of parallel template copies
         """
-        if self.open_rounds:
-            print("Another round is open.")
-            print("Aborting.")
-            exit(1)
+        with self.batch():
+            if self.open_rounds:
+                print("Another round is open.")
+                print("Aborting.")
+                exit(1)
 
-        self.config_dict['rounds'][round_name] = {'opened': datetime.now()}
+            self._set(('rounds', round_name), {'opened': datetime.now()})
 
-        self.copy_round_templates()
-        prepare_global_grading(round_name)
+            with self.repository.staging():
+                self.copy_round_templates(jobs)
+                prepare_global_grading(round_name, self.repository)
 
-        self._write_config()
+    def copy_round_templates(self, jobs=TEMPLATE_JOBS):
+        with self.repository.staging():
+            prepare_persons_grading(self.config_dict['persons'], self.current_round_name,
+                                    self.repository, jobs)
 
-    def copy_round_templates(self):
-        for person in self.config_dict['persons']:
-            prepare_person_grading(person, self.current_round_name)
-
-    def close_round(self):
+    def close_round(self, commit=False):
         """Close the currently open round.
 
         If no round is open, print an error message and exit.  Else, Write
         the close date to the config.
+
+        :param bool commit: Whether to commit the round and tag it with
+            its name, see :py:meth:`commit_round`
         """
-        if not self.open_rounds:
-            print("No round open!")
-            print("Aborting.")
+        with self.batch():
+            if not self.open_rounds:
+                print("No round open!")
+                print("Aborting.")
+                exit(1)
+
+            for name, data in self.config_dict['rounds'].items():
+                if not data.get('closed'):
+                    self._set(('rounds', name, 'closed'), datetime.now())
+                    round_name = name
+
+        if commit:
+            self.commit_round(round_name)
+
+    def commit_round(self, round_name):
+        """Commit the config and the folders of a round and tag it
+
+        The journal is compacted first, so that the committed snapshot
+        is complete.
+
+        :param str round_name: The round, also used as the tag
+        """
+        if os.path.exists(self.journal_filename):
+            self.compact()
+
+        paths = [self.filename, os.path.join(GLOBAL_FOLDER_NAME, round_name)]
+        paths += [os.path.join(person, round_name) for person in self.config_dict['persons']]
+        with self.repository.staging():
+            for path in paths:
+                if os.path.exists(path):
+                    self.repository.stage(path)
+
+        if not (self.repository.commit("Close round {}".format(round_name))
+                and self.repository.tag(round_name)):
+            print("Could not commit and tag round {}.".format(round_name))
             exit(1)
 
-        for name, data in self.config_dict['rounds'].items():
-            if not data.get('closed'):
-                self.config_dict['rounds'][name]['closed'] = datetime.now()
 
-        self._write_config()
 
+class LazyConfig:
+    """A proxy to a :py:class:`GradingConfig` loaded on first access
 
+    This way, importing this module does not parse the config.
+    """
+    def __init__(self, filename=CONFIG_FILENAME):
+        self._filename = filename
+        self._config = None
 
-config = GradingConfig()
+    def __getattr__(self, name):
+        if self._config is None:
+            self._config = GradingConfig(self._filename)
+        return getattr(self._config, name)
 
 
-def prepare_person_grading(person, round_):
-    """Populate a folder with default grading files.
+config = LazyConfig()
 
-    Expect only the ``person`` folder to be present.  The ``round``
-    folder is created if necessary.
 
-    At the end, Stage the file with git.
+def _copy_file(source, target, mode='wb'):
+    """Copy a file, inside the kernel if the system supports it
 
-    :param str person: The person
-    :param str round_: The round
+    :param str mode: The mode to open ``target`` in
+    """
+    with open(source, 'rb') as src, open(target, mode) as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                if not copied:
+                    break
+                remaining -= copied
+        except (AttributeError, OSError):
+            # ``copy_file_range`` is not supported here; start over
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+            shutil.copyfileobj(src, dst)
+
+
+def _instantiate_template(filename, content, template_filename=None):
+    """Create a grading file unless it exists already
+
+    :param str filename: The file to create
+    :param bytes content: The content of the template
+    :param str template_filename: The template to copy, or ``None`` to
+        write ``content`` instead
+
+    :returns: Whether the file has been created
+    :rtype: bool
     """
-    path = os.path.join(person, round_)
     try:
-        os.mkdir(path)
+        if template_filename:
+            _copy_file(template_filename, filename, mode='xb')
+        else:
+            with open(filename, 'xb') as stream:
+                stream.write(content)
     except FileExistsError:
-        pass
+        return False
+    return True
 
-    filename = os.path.join(path, GRADING_FILENAME)
-    template_filename = os.path.join(GLOBAL_FOLDER_NAME, round_, GRADING_FILENAME)
 
+def prepare_persons_grading(persons, round_, repository, jobs=TEMPLATE_JOBS):
+    """Populate the folders of a round with default grading files.
+
+    Expect only the ``person`` folders to be present.  The ``round``
+    folders are created if necessary.  The template is resolved once
+    and copied using ``jobs`` threads.  Existing grading files are
+    never overwritten, so that running this again only touches the
+    folders of new persons and keeps the grades given so far.
+
+    At the end, Stage the created files with git.
+
+    :param persons: The persons
+    :param str round_: The round
+    :param GitRepository repository: The repository to stage the files in
+    :param int jobs: The number of parallel copies
+    """
+    template_filename = os.path.join(GLOBAL_FOLDER_NAME, round_, GRADING_FILENAME)
     if os.path.isfile(template_filename):
-        shutil.copy(template_filename, filename)
+        with open(template_filename, 'rb') as stream:
+            content = stream.read()
     else:
         print("Template {} doesn't exist.  Using default template."
               .format(template_filename))
-        with open(filename, 'w') as file:
-            file.write(GRADING_TEMPLATE)
-
-    print("Created", filename)
-    subprocess.call(['git', 'add', filename])
-
-
-def prepare_global_grading(round_name):
+        template_filename = None
+        content = GRADING_TEMPLATE.encode()
+
+    # imported here, as only opening a round needs threads
+    from concurrent.futures import ThreadPoolExecutor
+
+    filenames = []
+    for person in persons:
+        path = os.path.join(person, round_)
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            pass
+        filenames.append(os.path.join(path, GRADING_FILENAME))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        written = list(executor.map(
+            lambda filename: _instantiate_template(filename, content, template_filename),
+            filenames))
+
+    for filename, created in zip(filenames, written):
+        if created:
+            print("Created", filename)
+            repository.stage(filename)
+    skipped = len(filenames) - sum(written)
+    if skipped:
+        print("Skipped {} existing grading files.".format(skipped))
+
+
+def prepare_global_grading(round_name, repository):
     path = os.path.join(GLOBAL_FOLDER_NAME, round_name)
     try:
         os.makedirs(path)
@@ -201,4 +518,4 @@ def prepare_global_grading(round_name):
     filename = os.path.join(path, GLOBAL_FILENAME)
     with open(filename, 'w') as file:
         file.write(GLOBAL_TEMPLATE)
-    subprocess.call(['git', 'add', filename])
+    repository.stage(filename)
@@ -0,0 +1,185 @@
+"""
+
+export.py
+~~~~~~~~~
+
+© Lukas Juhrich.
+
+"""
+import csv
+import hashlib
+import json
+import os
+import sys
+from array import array
+
+from atomic import dump_json, write_atomically
+from config import config
+from marks import SCAN_JOBS, GradeVector, extract_grade_pairs_from_files, scan_grading_tree
+
+
+EXPORT_FOLDER_NAME = 'export'
+EXPORT_CSV_NAME = 'grades.csv'
+EXPORT_MANIFEST_NAME = 'manifest.json'
+COLUMNS_FOLDER_NAME = 'columns'
+
+# Every round is stored as one file per column of doubles
+COLUMN_FIELDS = ('given_normal', 'given_extra', 'total_normal', 'total_extra', 'submitted')
+
+
+def round_signature(files):
+    """Fingerprint the grading files of a round by their stats
+
+    :param dict files: A dict mapping persons to ``(path, stat)``
+
+    :rtype: str
+    """
+    digest = hashlib.sha1()
+    for person in sorted(files):
+        _, stat = files[person]
+        digest.update("{}\0{}\0{}\n".format(person, stat.st_mtime_ns, stat.st_size).encode())
+    return digest.hexdigest()
+
+
+class ColumnarExport:
+    """A folder containing the person × round table of grades.
+
+    Each round is stored as binary column files of doubles (see
+    :py:data:`COLUMN_FIELDS`), which are only rewritten if a grading
+    file of that round changed, or if the persons or the byte order
+    changed.  The manifest keeps the persons, the byte order and a
+    signature of every round's files.  From the
+    columns, the complete table is written as CSV.
+    """
+    def __init__(self, folder=EXPORT_FOLDER_NAME):
+        self.folder = folder
+        self.manifest_filename = os.path.join(folder, EXPORT_MANIFEST_NAME)
+        try:
+            with open(self.manifest_filename) as stream:
+                self.manifest = json.load(stream)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def column_filename(self, round_, field):
+        return os.path.join(self.folder, COLUMNS_FOLDER_NAME, "{}.{}.f64".format(round_, field))
+
+    def _has_columns(self, round_):
+        return all(os.path.isfile(self.column_filename(round_, field)) for field in COLUMN_FIELDS)
+
+    def write_round(self, round_, persons, grades):
+        """Write the columns of a round
+
+        :param str round_: The round
+        :param list persons: The persons, defining the row order
+        :param dict grades: A dict mapping persons to the results of
+            :py:func:`marks.extract_grade_pairs`
+        """
+        missing = ((0.0, 0.0), (0.0, 0.0))
+        given = GradeVector.from_pairs(grades.get(p, missing)[0] for p in persons)
+        total = GradeVector.from_pairs(grades.get(p, missing)[1] for p in persons)
+        columns = {'given_normal': given.normal, 'given_extra': given.extra,
+                   'total_normal': total.normal, 'total_extra': total.extra,
+                   'submitted': array('d', (person in grades for person in persons))}
+
+        os.makedirs(os.path.join(self.folder, COLUMNS_FOLDER_NAME), exist_ok=True)
+        for field in COLUMN_FIELDS:
+            write_atomically(self.column_filename(round_, field), columns[field].tofile,
+                             mode='wb')
+
+    def read_round(self, round_, length):
+        """Read the columns of a round
+
+        :returns: A dict mapping every field to an ``array('d')``
+        """
+        columns = {}
+        for field in COLUMN_FIELDS:
+            column = array('d')
+            with open(self.column_filename(round_, field), 'rb') as stream:
+                column.fromfile(stream, length)
+            columns[field] = column
+        return columns
+
+    def remove_round(self, round_):
+        for field in COLUMN_FIELDS:
+            try:
+                os.unlink(self.column_filename(round_, field))
+            except FileNotFoundError:
+                pass
+
+    def write_csv(self, persons, rounds):
+        """Write the whole table as CSV from the column files"""
+        columns = {round_: self.read_round(round_, len(persons)) for round_ in rounds}
+        header = ['person']
+        for round_ in rounds:
+            header += ["{} {}".format(round_, field)
+                       for field in ('given', 'total') + COLUMN_FIELDS[:-1]]
+
+        def write(stream):
+            writer = csv.writer(stream)
+            writer.writerow(header)
+            for i, person in enumerate(persons):
+                row = [person]
+                for round_ in rounds:
+                    column = columns[round_]
+                    if not column['submitted'][i]:
+                        row += [''] * (len(COLUMN_FIELDS) + 1)
+                        continue
+                    row += [column['given_normal'][i] + column['given_extra'][i],
+                            column['total_normal'][i] + column['total_extra'][i]]
+                    row += [column[field][i] for field in COLUMN_FIELDS[:-1]]
+                writer.writerow(row)
+
+        write_atomically(os.path.join(self.folder, EXPORT_CSV_NAME), write)
+
+    def update(self, persons, rounds, jobs=SCAN_JOBS):
+        """Rewrite the columns of changed rounds, then the CSV
+
+        :param list persons: The persons
+        :param list rounds: The rounds
+        :param int jobs: The number of parallel workers
+
+        :returns: The rounds that have been rewritten
+        :rtype: list
+        """
+        files = {round_: {} for round_ in rounds}
+        for person, found in scan_grading_tree(persons, rounds, jobs):
+            for round_, path, stat in found:
+                files[round_][person] = (path, stat)
+        signatures = {round_: round_signature(files[round_]) for round_ in rounds}
+
+        known = self.manifest.get('rounds', {})
+        if (self.manifest.get('persons'), self.manifest.get('byteorder')) != (persons, sys.byteorder):
+            known = {}
+        changed = [round_ for round_ in rounds
+                   if known.get(round_) != signatures[round_] or not self._has_columns(round_)]
+
+        paths = [(round_, person, path) for round_ in changed
+                 for person, (path, _) in files[round_].items()]
+        grades = {round_: {} for round_ in changed}
+        for (round_, person, _), result in zip(
+                paths, extract_grade_pairs_from_files([path for _, _, path in paths], jobs)):
+            if result is not None:
+                grades[round_][person] = result
+
+        for round_ in changed:
+            self.write_round(round_, persons, grades[round_])
+        for round_ in set(self.manifest.get('rounds', {})) - set(rounds):
+            self.remove_round(round_)
+
+        self.manifest = {'persons': persons, 'byteorder': sys.byteorder, 'rounds': signatures}
+        self.write_csv(persons, rounds)
+        dump_json(self.manifest, self.manifest_filename, indent=2)
+        return changed
+
+
+def export_grades(jobs=SCAN_JOBS):
+    """Export the grades of everyone to :py:data:`EXPORT_FOLDER_NAME`
+
+    :param int jobs: The number of parallel workers
+    """
+    persons = list(config.config_dict['persons'])
+    rounds = list(config.config_dict['rounds'])
+    changed = ColumnarExport().update(persons, rounds, jobs)
+    print("Exported {} persons and {} rounds to '{}', rewrote {}."
+          .format(len(persons), len(rounds), EXPORT_FOLDER_NAME,
+                  ", ".join(changed) if changed else "nothing"))
@@ -10,71 +10,47 @@ grade.py
 # pylint: disable=invalid-name
 import argparse
 import os
-from email import message_from_string
+import sys
+from importlib import import_module
 
-from config import config
-from mail import save_attachment, fetch_mails, nice_header, iter_attachments, decode_attachment
-from marks import grades_overview
-from send_mail import format_mail
+import timings
+from config import CONFIG_FILENAME, config
 
-def list_mails():
-    """List all available mails in the inbox."""
-    for i, mail in enumerate(fetch_mails()):
-        message = message_from_string(mail.content)
-
-        subject = nice_header(message.get('subject', "<no subject>"))
-        sender = message.get('From', "<no sender>")
-        print("{:2d} {date} {sender} »{subj}«"
-              .format(i, date=mail.date, sender=sender, subj=subject))
 
+def init():
+    config.create_sample_config()
+    print("You can now start adding persons either manually or using this program.")
 
-def show_attachments(index):
-    """Show all attachments of a given mail
 
-    :param int index: the index of the mail
-    """
-    message = message_from_string(fetch_mails()[index].content)
-    print("Author:", message.get('From', "<no sender>"))
-    for attachment in iter_attachments(index):
-        filename = attachment.get_filename()
-        print("{name:=^80}".format(name=filename))
-        print("Is multipart:", "yes" if attachment.is_multipart() else "no")
-        print()
+def add_persons(*persons):
+    with config.batch():
+        for person in persons:
+            try:
+                os.mkdir(person)
+            except FileExistsError:
+                print("Folder for person {} already exists".format(person))
+            except OSError:
+                print("Error creating person '{}'".format(person))
+                continue
+            config.add_person(person)
 
-        print(decode_attachment(attachment))
 
+def resolve_command(target):
+    """Import the module of a subcommand only when it is run
 
-def save_attachments_of_person(index, person):
-    """The main subroutine for saving a person's attachments
+    :param target: A callable or a dotted path like
+        ``'module.attribute'``
 
-    :param int index: The message's index
-    :param str person: The name of the person folder to use
+    :returns: The callable
     """
-    if not person:
-        print("Person missing")
-        exit(1)
-
-    path = os.path.join(person, config.current_round_name)
+    if callable(target):
+        return target
 
-    for attachment in iter_attachments(index):
-        save_attachment(attachment, path=path)
-
-
-def init():
-    config.create_sample_config()
-    print("You can now start adding persons either manually or using this program.")
-
-
-def add_persons(*persons):
-    for person in persons:
-        try:
-            os.mkdir(person)
-        except FileExistsError:
-            print("Folder for person {} already exists".format(person))
-        except OSError:
-            print("Error creating person '{}'".format(person))
-            continue
-        config.add_person(person)
+    module_name, *attributes = target.split('.')
+    result = import_module(module_name)
+    for attribute in attributes:
+        result = getattr(result, attribute)
+    return result
 
 
 if __name__ == '__main__':
@@ -82,25 +58,55 @@ if __name__ == '__main__':
     parser.add_argument("command")
     parser.add_argument("-i", "--index", type=int, help="The mail to select")
     parser.add_argument("-p", "--person", type=str, help="The person folder to use ")
+    parser.add_argument("-j", "--jobs", type=int, help="The number of parallel workers")
+    parser.add_argument("--save", action='store_true', help="Save new mails when watching")
+    parser.add_argument("--rate", type=float, help="The mails per second when sending")
+    parser.add_argument("--commit", action='store_true',
+                        help="Commit and tag the round when closing it")
+    parser.add_argument("--timings", action='store_true',
+                        help="Print the time spent per phase to stderr")
+    parser.add_argument("--timings-json", metavar='FILE',
+                        help="Write the time spent per phase to a JSON file")
+    parser.add_argument("--profile", metavar='FILE',
+                        help="Run the command under cProfile and write the stats to FILE")
 
     parsed, unknown = parser.parse_known_args()
-    args = {param: value for param, value in parsed.__dict__.items() if value}
+    if parsed.jobs is not None and parsed.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    # keep given zeros, like ``--rate 0`` for no limit
+    args = {param: value for param, value in parsed.__dict__.items()
+            if value is not None and value is not False}
     unknown = [arg for arg in unknown if not arg.startswith('-')]
 
     command = args.pop('command')
+    print_timings = args.pop('timings', False)
+    timings_filename = args.pop('timings_json', None)
+    profile_filename = args.pop('profile', None)
+    if print_timings or timings_filename:
+        timings.enable()
 
     command_mapping = {
         'init': init,
-        'list': list_mails,
-        'show_files': show_attachments,
-        'save_files': save_attachments_of_person,
+        'list': 'mail_commands.list_mails',
+        'search': 'mail_commands.search',
+        'show_files': 'mail_commands.show_attachments',
+        'save_files': 'mail_commands.save_attachments_of_person',
+        'save_all': 'mail_commands.save_all_attachments',
+        'watch': 'mail_commands.watch',
         'add_persons': add_persons,
-        'delete_persons': config.delete_persons,
-        'add_round': config.add_round,
-        'prepare_round': config.copy_round_templates,
-        'close_round': config.close_round,
-        'format': format_mail,
-        'grades': grades_overview,
+        'delete_persons': 'config.config.delete_persons',
+        'add_round': 'config.config.add_round',
+        'prepare_round': 'config.config.copy_round_templates',
+        'close_round': 'config.config.close_round',
+        'compact': 'config.config.compact',
+        'add_mailbox': 'config.config.add_mailbox',
+        'format': 'send_mail.format_mail',
+        'send_round': 'send_mail.send_round',
+        'render_round': 'send_mail.render_round',
+        'flush_outbox': 'send_mail.flush_outbox',
+        'grades': 'marks.grades_overview',
+        'stats': 'gradebook.statistics_overview',
+        'export': 'export.export_grades',
     }
 
     try:
@@ -110,8 +116,21 @@ if __name__ == '__main__':
         print("Available:", ", ".join(command_mapping.keys()))
         exit(1)
 
+    if command != 'init' and not os.path.exists(CONFIG_FILENAME):
+        print("No config found, run 'init' first.")
+        exit(1)
+
+    if profile_filename:
+        # imported here, as profiling is rare
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
     try:
-        subcommand(*unknown, **args)
+        with timings.span('grade.import'):
+            subcommand = resolve_command(subcommand)
+        with timings.span('grade.' + command):
+            subcommand(*unknown, **args)
     except TypeError as e:
         error_string = e.args[0]
         if "unexpected keyword argument" in error_string:
@@ -120,3 +139,11 @@ if __name__ == '__main__':
             print("Missing argument:", error_string)
         else:
             raise
+    finally:
+        if profile_filename:
+            profiler.disable()
+            profiler.dump_stats(profile_filename)
+        if print_timings:
+            timings.print_summary(sys.stderr)
+        if timings_filename:
+            timings.write_json(timings_filename)
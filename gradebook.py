@@ -0,0 +1,188 @@
+"""
+
+gradebook.py
+~~~~~~~~~~~~
+
+© Lukas Juhrich.
+
+"""
+import warnings
+
+import numpy as np
+
+from config import config
+from marks import CELL_FMT, EXERCISES_NEEDED, NEEDED, grade_cache
+
+NORMAL, EXTRA = 0, 1
+PERCENTILES = (10, 25, 75, 90)
+HISTOGRAM_BINS = 10
+# Rounds whose mean score ratio is further away than this many
+# standard deviations from the mean of all rounds are outliers
+OUTLIER_THRESHOLD = 2.0
+
+NUMBER_FMT = "{: >8}"
+
+
+class Gradebook:
+    """All grades of the course as dense arrays.
+
+    :py:attr:`given` and :py:attr:`total` have the shape ``(2, persons,
+    rounds)``, where the first axis separates the :py:data:`NORMAL` and
+    :py:data:`EXTRA` planes.  :py:attr:`submitted` is ``False`` where
+    there is no grading file.
+    """
+    def __init__(self, persons, rounds):
+        self.persons = list(persons)
+        self.rounds = list(rounds)
+        shape = (2, len(self.persons), len(self.rounds))
+        self.given = np.zeros(shape)
+        self.total = np.zeros(shape)
+        self.submitted = np.zeros(shape[1:], dtype=bool)
+
+    @classmethod
+    def from_rows(cls, persons, rounds, rows):
+        """Build a gradebook from rows of :py:meth:`GradeCache.all_grades`
+
+        Rows of unknown persons or rounds are ignored.
+        """
+        gradebook = cls(persons, rounds)
+        person_index = {person: i for i, person in enumerate(gradebook.persons)}
+        round_index = {round_: j for j, round_ in enumerate(gradebook.rounds)}
+        rows = [row for row in rows if row[0] in person_index and row[1] in round_index]
+        if not rows:
+            return gradebook
+
+        persons, rounds, *values = zip(*rows)
+        i = np.fromiter((person_index[person] for person in persons), dtype=np.intp)
+        j = np.fromiter((round_index[round_] for round_ in rounds), dtype=np.intp)
+        given_normal, given_extra, total_normal, total_extra = np.array(values)
+
+        gradebook.given[NORMAL, i, j] = given_normal
+        gradebook.given[EXTRA, i, j] = given_extra
+        gradebook.total[NORMAL, i, j] = total_normal
+        gradebook.total[EXTRA, i, j] = total_extra
+        gradebook.submitted[i, j] = True
+        return gradebook
+
+    @classmethod
+    def load(cls):
+        """Load the gradebook of the configured persons and rounds"""
+        return cls.from_rows(config.config_dict['persons'], config.config_dict['rounds'],
+                             grade_cache().all_grades())
+
+    @property
+    def scores(self):
+        """The given points per cell, ``nan`` where nothing was submitted"""
+        return np.where(self.submitted, self.given.sum(axis=0), np.nan)
+
+    @property
+    def person_sums(self):
+        """The given points per person"""
+        return self.given.sum(axis=(0, 2))
+
+    @property
+    def submissions(self):
+        """The number of submissions per person"""
+        return self.submitted.sum(axis=1)
+
+    def round_statistics(self, percentiles=PERCENTILES):
+        """Compute per-round statistics of the submitted scores
+
+        :returns: A dict mapping ``'mean'``, ``'median'``, ``'count'``
+            and every percentile ``p`` to an array over the rounds.
+            Rounds without submissions are ``nan``.
+        :rtype: dict
+        """
+        scores = self.scores
+        with warnings.catch_warnings():
+            # rounds without any submission
+            warnings.simplefilter('ignore', RuntimeWarning)
+            statistics = {
+                'count': self.submitted.sum(axis=0),
+                'mean': np.nanmean(scores, axis=0),
+                'median': np.nanmedian(scores, axis=0),
+            }
+            if len(self.persons):
+                quantiles = np.nanpercentile(scores, percentiles, axis=0)
+            else:
+                quantiles = np.full((len(percentiles), len(self.rounds)), np.nan)
+        statistics.update(zip(percentiles, quantiles))
+        return statistics
+
+    def histogram(self, bins=HISTOGRAM_BINS):
+        """Compute a histogram of the summed points per person
+
+        :returns: The counts and the bin edges, see ``np.histogram``
+        """
+        return np.histogram(self.person_sums, bins=bins)
+
+    def on_track(self, rounds_planned=None):
+        """Determine who will reach :py:data:`NEEDED` points and
+        :py:data:`EXERCISES_NEEDED` submissions at the current rate
+
+        :param int rounds_planned: The number of rounds of the whole
+            course.  Defaults to the rounds so far.
+
+        :returns: A boolean array over the persons
+        """
+        if not self.rounds:
+            return np.zeros(len(self.persons), dtype=bool)
+        factor = (rounds_planned or len(self.rounds)) / len(self.rounds)
+        return ((self.person_sums * factor >= NEEDED)
+                & (self.submissions * factor >= EXERCISES_NEEDED))
+
+    def outlier_rounds(self, threshold=OUTLIER_THRESHOLD):
+        """Find the rounds with an unusual mean score ratio
+
+        The ratio of given and total points is used, so that rounds
+        with different totals are comparable.
+
+        :returns: The names of the outlier rounds
+        :rtype: list
+        """
+        total = self.total.sum(axis=0)
+        with warnings.catch_warnings(), np.errstate(divide='ignore', invalid='ignore'):
+            warnings.simplefilter('ignore', RuntimeWarning)
+            ratios = np.where(self.submitted & (total > 0),
+                              self.given.sum(axis=0) / total, np.nan)
+            means = np.nanmean(ratios, axis=0)
+            deviation = np.abs(means - np.nanmean(means)) / np.nanstd(means)
+        return [round_ for round_, outlier in zip(self.rounds, deviation > threshold) if outlier]
+
+
+def _format_number(value):
+    if isinstance(value, np.integer):
+        return "{:d}".format(value)
+    return "-" if np.isnan(value) else "{:.1f}".format(value)
+
+
+def statistics_overview(rounds_planned=None):
+    """Print course-wide statistics of the grades
+
+    :param rounds_planned: The number of rounds of the whole course,
+        used to tell who is on track.  Defaults to the rounds so far.
+    """
+    gradebook = Gradebook.load()
+    rounds_planned = int(rounds_planned) if rounds_planned else None
+    statistics = gradebook.round_statistics()
+    columns = ['count', 'mean', 'median'] + list(PERCENTILES)
+
+    print(CELL_FMT.format("Round")
+          + ''.join(NUMBER_FMT.format(column if isinstance(column, str) else "p{}".format(column))
+                    for column in columns))
+    for j, round_ in enumerate(gradebook.rounds):
+        print(CELL_FMT.format(round_)
+              + ''.join(NUMBER_FMT.format(_format_number(statistics[column][j]))
+                        for column in columns))
+
+    counts, edges = gradebook.histogram()
+    print("\nPoints per person:")
+    for count, low, high in zip(counts, edges, edges[1:]):
+        print("{:6.1f} – {:6.1f}: {}".format(low, high, '#' * count))
+
+    on_track = gradebook.on_track(rounds_planned)
+    print("\n{} of {} persons are on track to reach {} points and {} exercises."
+          .format(on_track.sum(), len(gradebook.persons), NEEDED, EXERCISES_NEEDED))
+    outliers = gradebook.outlier_rounds()
+    if outliers:
+        print("Outlier rounds:", ", ".join(outliers))
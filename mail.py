@@ -7,19 +7,40 @@ mail.py
 
 """
 # pylint: disable=invalid-name
+import binascii
+import hashlib
+import heapq
+import json
+import mmap
 import os
 import re
-from collections import deque, namedtuple
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
 from datetime import datetime
-from email import message_from_string
+from email import message_from_bytes
 from email.header import decode_header
+from email.utils import parsedate_to_datetime
+from email.parser import BytesHeaderParser
+from itertools import islice
 from operator import attrgetter
 
+from atomic import dump_json
+from attachment_store import AttachmentStore, SubmissionManifest
+from timings import count, span
+
 
 PROFILE = "scz1uax0.default"
 FOLDER = "msx.tu-dresden.de/Prog"
 
 RE_MSG_SPLIT = re.compile(r"^From - (.*)\n", flags=re.MULTILINE)
+RE_MSG_SEPARATOR = re.compile(rb"^From - (.*?)\r?\n", flags=re.MULTILINE)
+RE_HEADER_END = re.compile(rb"\r?\n\r?\n")
+
+# The index lives next to the ``.grade`` config in the course folder
+INDEX_FILENAME = '.grade-index'
+INDEX_VERSION = 2
+MESSAGE_CACHE_SIZE = 32
+DECODE_CHUNK_SIZE = 64 * 1024
 
 
 def get_file_path(profile=PROFILE, folder=FOLDER):
@@ -106,50 +127,687 @@ def nice_header(encoded_string):
     return string_like.decode(word[1])
 
 
-def fetch_mails():
-    """Return mails of the inbox sorted by date.
+@contextmanager
+def open_mailbox(path):
+    """Map a mailbox file read-only into memory
+
+    The mapping is backed by the file, so only the pages actually
+    touched end up in memory.  An empty file cannot be mapped and
+    yields ``b''`` instead.
+
+    :param str path: The path to the mbox file
+
+    :returns: A context manager yielding a bytes-like buffer
+    """
+    with open(path, 'rb') as desc:
+        try:
+            buffer = mmap.mmap(desc.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            yield b''
+            return
+        try:
+            yield buffer
+        finally:
+            buffer.close()
+
+
+def parse_separator_date(raw, date_format=DATE_FORMAT):
+    """Parse the date of a ``From - `` separator line
+
+    :param bytes raw: The part of the separator following ``From - ``
+    :param str date_format: the date format specifier.  If falsy,
+        return the decoded string.
+    """
+    date_string = raw.decode('ascii', 'replace')
+    if date_format:
+        return datetime.strptime(date_string, date_format)
+    return date_string
+
+
+_mail_view = namedtuple("mail_view", ['date', 'offset', 'length'])
+def iter_mail_views(buffer, regex=RE_MSG_SEPARATOR, date_format=DATE_FORMAT, start=0):
+    """Lazily iterate over the mails contained in a bytes-like buffer
+
+    In contrast to :py:func:`iter_mails`, the buffer is neither decoded
+    nor split.  The separators are searched incrementally and every
+    mail is yielded as soon as the next separator (or the end of the
+    buffer) has been found.
+
+    :param buffer: A bytes-like object, e.g. from
+        :py:func:`open_mailbox`
+    :param re regex: The separator regex.  Must have one capture
+        group containing the date.
+    :param str date_format: the date format specifier
+    :param int start: The offset to start searching at.  Must be at
+        the beginning of a line.
+
+    :return: An iterator over the mails as ``(date, offset, length)``
+        views, where ``offset`` and ``length`` span the content
+        following the separator line.
+    :rtype: iterator[_mail_view]
+    """
+    previous = None
+    for match in regex.finditer(buffer, start):
+        if previous is not None:
+            yield _mail_view(parse_separator_date(previous.group(1), date_format),
+                             previous.end(), match.start() - previous.end())
+        previous = match
+
+    if previous is not None:
+        yield _mail_view(parse_separator_date(previous.group(1), date_format),
+                         previous.end(), len(buffer) - previous.end())
+
+
+def header_block(buffer, view):
+    """Return the header block of a mail without touching its body
+
+    The block ends with the first blank line.  Only the bytes up to
+    that line are scanned and copied, so the cost does not depend on
+    the size of the attachments.
+
+    :param buffer: A bytes-like object containing the mail
+    :param view: A mail view as yielded by :py:func:`iter_mail_views`
+
+    :rtype: bytes
+    """
+    end = view.offset + view.length
+    match = RE_HEADER_END.search(buffer, view.offset, end)
+    return buffer[view.offset:match.end() if match else end]
+
+
+def parse_headers(buffer, view):
+    """Parse only the header block of a mail
+
+    :param buffer: A bytes-like object containing the mail
+    :param view: A mail view as yielded by :py:func:`iter_mail_views`
+
+    :returns: A message with an empty payload
+    :rtype: Message
+    """
+    return BytesHeaderParser().parsebytes(header_block(buffer, view))
+
 
-    Sort :py:func:`iter_mails` by ``getattr('date')``.  Note that the
-    latter might differ from the actual ``"From:"``-header of the
-    mail.
+def _mail_path(view, path=None):
+    """Return ``path``, else the file of an index entry, else the default"""
+    return path or getattr(view, 'path', None) or get_file_path()
+
+
+def read_mail(view, path=None):
+    """Read the raw bytes of a single mail
+
+    :param view: A mail view as yielded by :py:func:`iter_mail_views`
+    :param str path: The mbox file.  Defaults to the ``path`` of an
+        index entry or :py:func:`get_file_path`.
+
+    :rtype: bytes
+    """
+    count('files opened')
+    count('bytes read', view.length)
+    with open(_mail_path(view, path), 'rb') as desc:
+        desc.seek(view.offset)
+        return desc.read(view.length)
+
+
+def read_message(view, path=None):
+    """Read and parse a single mail
+
+    :param view: A mail view as yielded by :py:func:`iter_mail_views`
+    :param str path: The mbox file, see :py:func:`read_mail`
+
+    :rtype: Message
+    """
+    raw = read_mail(view, path)
+    count('messages parsed')
+    with span('mail.parse'):
+        return message_from_bytes(raw)
+
+
+# ``path`` is the file the mail is read from, which is not stored in
+# the index of an mbox
+_indexed_mail = namedtuple("indexed_mail",
+                           ['date', 'offset', 'length', 'sender', 'subject', 'message_id',
+                            'path'],
+                           defaults=(None,))
+def _load_index_data(filename, mailbox):
+    """Load an index file if it belongs to ``mailbox``
+
+    :returns: The parsed JSON, or ``None`` if the file is missing,
+        broken, outdated or belongs to another mailbox
+    :rtype: dict
+    """
+    try:
+        with open(filename) as stream:
+            data = json.load(stream)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if data.get('version') != INDEX_VERSION or data.get('mailbox') != mailbox:
+        return None
+    return data
+
+
+class MailIndex:
+    """A persistent index of the mails of an mbox file.
+
+    For every mail, the byte offset and length of its content, the
+    separator date and the raw ``From``, ``Subject`` and ``Message-ID``
+    headers are stored in :py:attr:`filename`, sorted by date like
+    :py:func:`fetch_mails` used to do.
+
+    The index remembers inode, size and mtime of the mailbox.  If the
+    mailbox grew, only the appended region is scanned.  If it has been
+    replaced, shrunk or the last indexed separator moved (e.g. after
+    Thunderbird compacted the folder), the index is rebuilt from
+    scratch and :py:attr:`rebuilt` is set.
+    """
+    def __init__(self, mailbox=None, filename=INDEX_FILENAME):
+        self.mailbox = mailbox or get_file_path()
+        self.filename = filename
+        self.inode = None
+        self.size = None
+        self.mtime = None
+        self.mails = []
+        self.rebuilt = False
+        self._load_index()
+
+    def _load_index(self):
+        """Load :py:attr:`filename` if it belongs to our mailbox"""
+        data = _load_index_data(self.filename, self.mailbox)
+        if data is None:
+            return
+
+        self.inode = data.get('inode')
+        self.size = data['size']
+        self.mtime = data['mtime']
+        self.mails = [_indexed_mail(datetime.fromisoformat(date), *rest, path=self.mailbox)
+                      for date, *rest in data['mails']]
+
+    def _write_index(self):
+        """Atomically dump the index to :py:attr:`filename`"""
+        data = {
+            'version': INDEX_VERSION,
+            'mailbox': self.mailbox,
+            'inode': self.inode,
+            'size': self.size,
+            'mtime': self.mtime,
+            'mails': [(mail.date.isoformat(), *mail[1:-1]) for mail in self.mails],
+        }
+        dump_json(data, self.filename)
+
+    def _resume_offset(self, buffer):
+        """Determine where to continue scanning ``buffer``
+
+        Drop the last mail from the index, because it may have grown,
+        and return the offset of its separator.  Return ``None`` if
+        the index does not match the buffer anymore.
+        """
+        if not self.mails or len(buffer) < self.size:
+            return None
+
+        last = max(self.mails, key=attrgetter('offset'))
+        start = buffer.rfind(b'From - ', 0, last.offset)
+        match = RE_MSG_SEPARATOR.match(buffer, start) if start >= 0 else None
+        if (match is None or match.end() != last.offset
+                or (start and buffer[start - 1:start] != b'\n')
+                or parse_separator_date(match.group(1)) != last.date):
+            return None
+
+        self.mails.remove(last)
+        return start
+
+    def _index_mail(self, buffer, view):
+        """Build an index entry by parsing the headers of a view"""
+        return _index_entry(view, parse_headers(buffer, view), self.mailbox)
+
+    def update(self):
+        """Bring the index up to date with the mailbox and save it.
+
+        :returns: Whether the index changed
+        :rtype: bool
+        """
+        stat = os.stat(self.mailbox)
+        self.rebuilt = False
+        if (stat.st_ino, stat.st_size, stat.st_mtime) == (self.inode, self.size, self.mtime):
+            return False
+
+        with span('mail.index'), open_mailbox(self.mailbox) as buffer:
+            start = self._resume_offset(buffer) if stat.st_ino == self.inode else None
+            if start is None:
+                self.rebuilt = bool(self.mails)
+                self.mails, start = [], 0
+            new_mails = [self._index_mail(buffer, view)
+                         for view in iter_mail_views(buffer, start=start)]
+            count('files opened')
+            count('bytes read', len(buffer) - start)
+            count('headers parsed', len(new_mails))
+
+        self.mails = sorted(self.mails + new_mails, key=attrgetter('date'))
+        self.inode, self.size, self.mtime = stat.st_ino, stat.st_size, stat.st_mtime
+        self._write_index()
+        return True
+
+
+def _header_date(value):
+    """Parse a ``Date`` header into a naive local datetime
+
+    Naive, like the separator dates, so that both can be compared.
+
+    :returns: The date, or ``None`` if it is missing or invalid
+    """
+    try:
+        date = parsedate_to_datetime(str(value))
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date.tzinfo is not None:
+        date = date.astimezone().replace(tzinfo=None)
+    return date
+
+
+class MaildirIndex:
+    """A persistent index of the mails of a Maildir directory.
+
+    Every file in ``new`` and ``cur`` is a mail.  Its headers are
+    parsed once and stored in :py:attr:`filename` under the unique part
+    of the filename, which stays the same when a mail client moves it
+    or changes its flags.  The mails are dated by their ``Date``
+    header, or the modification time of the file if there is none.
+
+    It has the same interface as :py:class:`MailIndex`.
+    """
+    def __init__(self, mailbox, filename=INDEX_FILENAME):
+        self.mailbox = mailbox
+        self.filename = filename
+        self.entries = {}
+        self.mails = []
+        self.rebuilt = False
+        self._load_index()
+
+    def _load_index(self):
+        """Load :py:attr:`filename` if it belongs to our Maildir"""
+        data = _load_index_data(self.filename, self.mailbox)
+        if data is None:
+            return
+        self.entries = {key: _indexed_mail(datetime.fromisoformat(date), *rest)
+                        for key, (date, *rest) in data['mails'].items()}
+        self.mails = self._sorted_mails(self.entries)
+
+    def _write_index(self):
+        """Atomically dump the index to :py:attr:`filename`"""
+        data = {
+            'version': INDEX_VERSION,
+            'mailbox': self.mailbox,
+            'mails': {key: (mail.date.isoformat(), *mail[1:])
+                      for key, mail in self.entries.items()},
+        }
+        dump_json(data, self.filename)
+
+    @staticmethod
+    def _sorted_mails(entries):
+        """Sort the mails by date, then by their unique key
+
+        Unlike the path, the key does not change when a mail is moved
+        or flagged, so mails of the same date keep their order.
+        """
+        return [mail for _, mail in sorted(entries.items(),
+                                           key=lambda item: (item[1].date, item[0]))]
+
+    @staticmethod
+    def _index_file(path):
+        """Build an index entry by parsing the headers of a file"""
+        lines = []
+        with open(path, 'rb') as stream:
+            for line in stream:
+                if line in (b'\n', b'\r\n'):
+                    break
+                lines.append(line)
+            stat = os.fstat(stream.fileno())
+        count('files opened')
+        headers = BytesHeaderParser().parsebytes(b''.join(lines))
+        date = _header_date(headers.get('Date')) or datetime.fromtimestamp(stat.st_mtime)
+        return _index_entry((date, 0, stat.st_size), headers, path)
+
+    def update(self):
+        """Bring the index up to date with the Maildir and save it.
+
+        :returns: Whether the index changed
+        :rtype: bool
+        """
+        found = {}
+        for folder in ('new', 'cur'):
+            try:
+                with os.scandir(os.path.join(self.mailbox, folder)) as files:
+                    for entry in files:
+                        if entry.is_file() and not entry.name.startswith('.'):
+                            found[entry.name.split(':', 1)[0]] = entry.path
+            except FileNotFoundError:
+                continue
+
+        changed = found.keys() != self.entries.keys()
+        entries = {}
+        with span('mail.index'):
+            for key, path in found.items():
+                mail = self.entries.get(key)
+                if mail is None:
+                    mail = self._index_file(path)
+                    count('headers parsed')
+                elif mail.path != path:
+                    mail = mail._replace(path=path)
+                    changed = True
+                entries[key] = mail
+
+        if changed:
+            self.entries = entries
+            self.mails = self._sorted_mails(entries)
+            self._write_index()
+        return changed
+
+
+def _index_entry(view, headers, path):
+    """Build an index entry of a view and its parsed headers"""
+    return _indexed_mail(*view,
+                         sender=str(headers.get('From', "<no sender>")),
+                         subject=str(headers.get('Subject', "<no subject>")),
+                         message_id=str(headers.get('Message-ID', '')).strip(),
+                         path=path)
+
+
+def configured_mailboxes():
+    """Return the mailboxes listed under ``mailboxes`` in the config
+
+    Defaults to the Thunderbird folder of :py:func:`get_file_path`.
 
-    :returns: A sorted list of mails
     :rtype: list
     """
-    with open(get_file_path()) as desc:
-        content = desc.read()
-    return sorted(iter_mails(content), key=attrgetter('date'))
+    # imported here, as reading mails does not need a config otherwise
+    from config import config
+    paths = config.config_dict.get('mailboxes') or []
+    return [os.path.expanduser(path) for path in paths] or [get_file_path()]
+
+
+class MailSources:
+    """The indexes of all mailboxes submissions arrive in.
+
+    Every source is either an mbox file, indexed by
+    :py:class:`MailIndex`, or a Maildir directory, indexed by
+    :py:class:`MaildirIndex`.  As each index keeps its mails sorted by
+    date, :py:meth:`iter_mails` lazily merges them using a heap
+    instead of sorting everything.  Mails of the same date are ordered
+    by their source's position, so the numbering is stable unless a
+    mail older than the ones already indexed arrives.
+
+    :param list paths: The mailboxes.  Defaults to
+        :py:func:`configured_mailboxes`.
+    :param str index_filename: The index file.  With more than one
+        mailbox, every mailbox gets an index file of its own, suffixed
+        by a hash of its path.
+    """
+    def __init__(self, paths=None, index_filename=INDEX_FILENAME):
+        paths = paths or configured_mailboxes()
+        self.indexes = []
+        for path in paths:
+            filename = index_filename
+            if len(paths) > 1:
+                digest = hashlib.sha1(os.fsencode(path)).hexdigest()[:12]
+                filename = "{}-{}".format(index_filename, digest)
+            index_class = MaildirIndex if os.path.isdir(path) else MailIndex
+            self.indexes.append(index_class(path, filename))
+
+    @property
+    def paths(self):
+        return [index.mailbox for index in self.indexes]
+
+    @property
+    def rebuilt(self):
+        """Whether an index has been rebuilt by the last update"""
+        return any(index.rebuilt for index in self.indexes)
+
+    def update(self):
+        """Update all indexes
+
+        :returns: Whether one of them changed
+        :rtype: bool
+        """
+        return any([index.update() for index in self.indexes])
+
+    def iter_mails(self):
+        """Merge the mails of all sources by date
+
+        :rtype: iterator[_indexed_mail]
+        """
+        return heapq.merge(*(index.mails for index in self.indexes), key=attrgetter('date'))
+
+
+def iter_all_mails(index_filename=INDEX_FILENAME, mailboxes=None):
+    """Lazily iterate over the mails of all mailboxes sorted by date.
+
+    The mails are taken from the indexes of :py:class:`MailSources`,
+    which are updated first.  Mails of an mbox are dated by the
+    separator line, which might differ from the actual
+    ``"From:"``-header of the mail.  The mails are not read, use
+    :py:func:`read_message` for that.
+
+    :param str index_filename: The file to keep the index in
+    :param list mailboxes: The mailboxes, see :py:class:`MailSources`
+
+    :rtype: iterator[_indexed_mail]
+    """
+    sources = MailSources(mailboxes, index_filename)
+    sources.update()
+    return sources.iter_mails()
 
 
-def iter_attachments(index):
-    """Iterate over a mail's attachments
+def fetch_mails(index_filename=INDEX_FILENAME, mailboxes=None):
+    """Return the mails of all mailboxes sorted by date.
 
-    :param index: The index of the mail.
+    See :py:func:`iter_all_mails`.
+
+    :returns: A sorted list of index entries
+    :rtype: list[_indexed_mail]
+    """
+    return list(iter_all_mails(index_filename, mailboxes))
+
+
+def nth_mail(index, index_filename=INDEX_FILENAME):
+    """Return the mail of a given index, as numbered by :py:func:`fetch_mails`
+
+    Only the mails up to ``index`` are merged.
+
+    :raises IndexError: If there is no such mail
+    """
+    if index < 0:
+        return fetch_mails(index_filename)[index]
+    try:
+        return next(islice(iter_all_mails(index_filename), index, None))
+    except StopIteration:
+        raise IndexError("mail index out of range")
+
+
+def mail_key(mail):
+    """Return a key identifying a mail independently of its offset
+
+    :param mail: An index entry
+
+    :returns: The ``Message-ID`` or, if missing, date and sender
+    :rtype: str
+    """
+    return mail.message_id or "{}|{}".format(mail.date.isoformat(), mail.sender)
+
+
+_cache_info = namedtuple("cache_info", ['hits', 'misses', 'maxsize', 'currsize'])
+class MessageCache:
+    """A bounded LRU cache of parsed messages.
+
+    Messages are keyed by the identity of the mailbox file (device and
+    inode) together with the offset and length of the mail, so they
+    stay valid while Thunderbird appends to the mailbox.
+    """
+    def __init__(self, maxsize=MESSAGE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._messages = OrderedDict()
+
+    def get(self, view, path=None):
+        """Return the parsed message of a view, reading it if necessary
+
+        :param view: A mail view or index entry
+        :param str path: The mbox file, see :py:func:`read_mail`
+
+        :rtype: Message
+        """
+        path = _mail_path(view, path)
+        stat = os.stat(path)
+        key = (stat.st_dev, stat.st_ino, view.offset, view.length)
+
+        try:
+            message = self._messages[key]
+        except KeyError:
+            self.misses += 1
+            count('message cache misses')
+            message = self._messages[key] = read_message(view, path)
+            if len(self._messages) > self.maxsize:
+                self._messages.popitem(last=False)
+        else:
+            self.hits += 1
+            count('message cache hits')
+            self._messages.move_to_end(key)
+        return message
+
+    def cache_info(self):
+        """Report the hit and miss counters like ``functools.lru_cache``"""
+        return _cache_info(self.hits, self.misses, self.maxsize, len(self._messages))
+
+    def clear(self):
+        """Empty the cache and reset the counters"""
+        self._messages.clear()
+        self.hits = self.misses = 0
+
+
+message_cache = MessageCache()
+
+
+def get_message(index):
+    """Return the parsed mail of a given index using :py:data:`message_cache`
+
+    :param int index: The index of the mail.
+
+    :rtype: Message
+    """
+    return message_cache.get(nth_mail(index))
+
+
+def iter_message_attachments(message):
+    """Iterate over the attachments of a parsed message
+
+    :param Message message: The message
 
     :returns: An iterator over the MIME-parts where ``get_filename()``
               evaluates to ``True``
     :rtype: iterator[part]
     """
-    mail_string = list(fetch_mails())[index].content
-    mail = message_from_string(mail_string)
-    for part in mail.walk():
+    for part in message.walk():
         filename = part.get_filename()
         if not filename:
             continue
         yield part
 
 
-def save_attachment(attachment, path, name_converter=None):
+def iter_attachments(index):
+    """Iterate over a mail's attachments
+
+    :param index: The index of the mail.
+
+    :returns: An iterator over the MIME-parts where ``get_filename()``
+              evaluates to ``True``
+    :rtype: iterator[part]
+    """
+    return iter_message_attachments(get_message(index))
+
+
+def _payload_bytes(string):
+    """Encode a chunk of an undecoded payload like ``email`` does"""
+    try:
+        return string.encode('ascii', 'surrogateescape')
+    except UnicodeEncodeError:
+        return string.encode('raw-unicode-escape')
+
+
+def _iter_base64(payload, chunk_size):
+    pending = ''
+    for start in range(0, len(payload), chunk_size):
+        data = pending + ''.join(payload[start:start + chunk_size].split())
+        cut = len(data) - len(data) % 4
+        pending = data[cut:]
+        yield binascii.a2b_base64(_payload_bytes(data[:cut]))
+
+    if pending:
+        try:
+            # superfluous padding is ignored
+            yield binascii.a2b_base64(_payload_bytes(pending + '=='))
+        except binascii.Error:
+            pass
+
+
+def _iter_quoted_printable(payload, chunk_size):
+    start = 0
+    while start < len(payload):
+        # only cut after line breaks to keep soft line breaks intact
+        end = payload.find('\n', start + chunk_size) + 1 or len(payload)
+        yield binascii.a2b_qp(_payload_bytes(payload[start:end]))
+        start = end
+
+
+def iter_decoded_payload(attachment, chunk_size=DECODE_CHUNK_SIZE):
+    """Decode the payload of a MIME part in fixed-size chunks
+
+    Unlike ``get_payload(decode=True)``, base64 and quoted-printable
+    payloads are never decoded as a whole.  Other transfer encodings
+    are passed on as one chunk.
+
+    :param Message attachment: The Mime-Part to decode
+    :param int chunk_size: The number of encoded characters to decode
+        at once
+
+    :returns: An iterator over the decoded chunks
+    :rtype: iterator[bytes]
+    """
+    encoding = str(attachment.get('content-transfer-encoding', '')).strip().lower()
+    payload = attachment.get_payload()
+
+    if attachment.is_multipart():
+        return
+    elif encoding == 'base64':
+        yield from _iter_base64(payload, chunk_size)
+    elif encoding == 'quoted-printable':
+        yield from _iter_quoted_printable(payload, chunk_size)
+    else:
+        yield attachment.get_payload(decode=True)
+
+
+_saved_attachment = namedtuple("saved_attachment", ['path', 'size', 'checksum'])
+def save_attachment(attachment, path, name_converter=None, mail=None, store=None):
     """Save an attachment in a given folder
 
-    Writes the Message payload to a file of name 'path' to the
-    filename.
+    Decodes the Message payload chunk by chunk into the content-addressed
+    :py:class:`AttachmentStore`, so the memory used does not depend on
+    the size of the attachment and identical files are stored once.
+    The object is then linked to the filename in ``path``.
+
+    If ``mail`` is given, the version is recorded in the folder's
+    :py:class:`SubmissionManifest` and only linked if it is the latest
+    one.
 
     :param Message attachment: The Mime-Part containing the
         attachment.
     :param str path: The path to the folder to save the attachments
         in.
     :param callable name_converter: A callable converting the filename
+    :param mail: The index entry of the mail the attachment belongs to
+    :param AttachmentStore store: The store to use
+
+    :returns: The path, its size and the sha256 hex digest of the
+        attachment
+    :rtype: _saved_attachment
     """
     if not os.path.exists(path):
         os.makedirs(path)
@@ -157,10 +815,36 @@ def save_attachment(attachment, path, name_converter=None):
     if name_converter is not None:
         filename = name_converter(filename)
     full_path = os.path.join(path, filename)
+    if store is None:
+        store = AttachmentStore()
+
+    checksum = hashlib.sha256()
+    size = 0
+    with span('mail.save'), store.temporary_file() as fd:
+        try:
+            for chunk in iter_decoded_payload(attachment):
+                fd.write(chunk)
+                checksum.update(chunk)
+                size += len(chunk)
+        except BaseException:
+            os.unlink(fd.name)
+            raise
+    checksum = checksum.hexdigest()
+    store.add(fd.name, checksum)
+    count('bytes written', size)
+
+    if mail is not None:
+        manifest = SubmissionManifest(path)
+        manifest.record(filename, checksum, mail_key(mail), mail.date)
+        latest = manifest.latest(filename)
+        if latest['checksum'] != checksum:
+            print("Skipping '{}', a newer version arrived on {}."
+                  .format(full_path, latest['date']))
+            return _saved_attachment(full_path, size, checksum)
 
     print("Writing to '{}'…".format(full_path))
-    with open(full_path, 'wb') as fd:
-        fd.write(attachment.get_payload(decode=True))
+    store.link(checksum, full_path)
+    return _saved_attachment(full_path, size, checksum)
 
 
 ENCODINGS = ('utf-8', 'latin-1')
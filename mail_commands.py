@@ -0,0 +1,162 @@
+"""
+
+mail_commands.py
+~~~~~~~~~~~~~~~~
+
+The subcommands of ``grade.py`` dealing with the mailbox.
+
+© Lukas Juhrich.
+
+"""
+# pylint: disable=invalid-name
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parseaddr
+
+from config import config
+from mail import save_attachment, iter_all_mails, nice_header, iter_attachments, \
+    decode_attachment, get_message, iter_message_attachments, mail_key, message_cache, nth_mail, \
+    read_message
+
+
+def print_mail(index, mail):
+    """Print a one-line summary of an index entry"""
+    print("{:2d} {date} {sender} »{subj}«"
+          .format(index, date=mail.date, sender=mail.sender, subj=nice_header(mail.subject)))
+
+
+def list_mails():
+    """List all available mails in the inbox.
+
+    Only the headers stored in the mail index are used, so no message
+    body is read.
+    """
+    for i, mail in enumerate(iter_all_mails()):
+        print_mail(i, mail)
+
+
+def search(*words):
+    """List the mails matching all given words.
+
+    Words are looked up in sender, subject, attachment filenames and
+    text parts.
+    """
+    if not words:
+        print("Search words missing")
+        exit(1)
+
+    # imported here, so that the other commands need not load it
+    from search import search_mails
+
+    for i, mail in search_mails(*words):
+        print_mail(i, mail)
+
+
+def show_attachments(index):
+    """Show all attachments of a given mail
+
+    :param int index: the index of the mail
+    """
+    message = get_message(index)
+    print("Author:", message.get('From', "<no sender>"))
+    for attachment in iter_attachments(index):
+        filename = attachment.get_filename()
+        print("{name:=^80}".format(name=filename))
+        print("Is multipart:", "yes" if attachment.is_multipart() else "no")
+        print()
+
+        print(decode_attachment(attachment))
+
+
+def save_attachments_of_person(index, person):
+    """The main subroutine for saving a person's attachments
+
+    :param int index: The message's index
+    :param str person: The name of the person folder to use
+    """
+    if not person:
+        print("Person missing")
+        exit(1)
+
+    path = os.path.join(person, config.current_round_name)
+
+    mail = nth_mail(index)
+    for attachment in iter_message_attachments(message_cache.get(mail)):
+        save_attachment(attachment, path=path, mail=mail)
+
+
+SAVE_JOBS = 4
+
+def save_all_attachments(jobs=SAVE_JOBS):
+    """Save the attachments of every new mail of the current round
+
+    Mails received after the round has been opened are matched to a
+    person by their sender address and saved to ``person/round`` in a
+    pool of ``jobs`` workers, handling one person per worker at a
+    time.  Saved mails are recorded in the config, so they are skipped
+    next time.
+
+    :param int jobs: The number of mails to save concurrently
+    """
+    round_name = config.current_round_name
+    opened = config.config_dict['rounds'][round_name]['opened']
+    persons = config.persons_by_address()
+    processed = config.processed_mails()
+
+    matched, unmatched = defaultdict(list), []
+    for i, mail in enumerate(iter_all_mails()):
+        if mail.date < opened or mail_key(mail) in processed:
+            continue
+        person = persons.get(parseaddr(mail.sender)[1].lower())
+        if person is None:
+            unmatched.append((i, mail))
+        else:
+            matched[person].append(mail)
+
+    saved = []
+
+    def save(person, mails):
+        path = os.path.join(person, round_name)
+        for mail in mails:
+            # not through ``message_cache``: every new mail is read once,
+            # so caching them would only evict the mails worth keeping
+            for attachment in iter_message_attachments(read_message(mail)):
+                save_attachment(attachment, path=path, mail=mail)
+            saved.append(mail)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(save, person, mails) for person, mails in matched.items()]
+            for future in as_completed(futures):
+                future.result()
+    finally:
+        if saved:
+            config.mark_processed(mail_key(mail) for mail in saved)
+
+    total = sum(len(mails) for mails in matched.values()) + len(unmatched)
+    print("Saved {} of {} new mails.".format(len(saved), total))
+    if unmatched:
+        print("Unknown senders:")
+    for i, mail in unmatched:
+        print_mail(i, mail)
+
+
+def watch(save=False):
+    """Print new mails as soon as they arrive
+
+    :param bool save: Whether to save the new mails of known persons
+        to the current round, see :py:func:`save_all_attachments`
+    """
+    # imported here, as it loads ``ctypes`` and ``select`` for inotify
+    from watch import iter_new_mails
+
+    print("Waiting for new mails, press Ctrl-C to stop.")
+    try:
+        for new_mails in iter_new_mails():
+            for i, mail in new_mails:
+                print_mail(i, mail)
+            if save:
+                save_all_attachments()
+    except KeyboardInterrupt:
+        pass
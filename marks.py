@@ -1,25 +1,44 @@
 import os
 import re
-from config import config
-from operator import itemgetter
+import sqlite3
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from config import config, GRADING_FILENAME
+from functools import lru_cache, partial
+from math import fsum
+from operator import add, itemgetter
+
+from timings import count, span
 
 GRADE_REGEX = r" *#\+BEGIN_RESULT\n(?P<given>.*)/(?P<total>.*)\n *#\+END_RESULT"
 
+def split_grade(string):
+    """Split a grade like ``"8+2"`` into its normal and extra points
+
+    :returns: A ``(normal, extra)`` tuple of floats
+    :raises ValueError: If there is more than one separator
+    """
+    splitted = string.split('+')
+    if len(splitted) <= 2:
+        normal, extra = (splitted + [''])[:2]
+        return float(normal or 0), float(extra or 0)
+
+    normal, extra, rest = splitted
+    if rest:
+        raise ValueError("More than one separator: %s", string)
+    return float(normal), float(extra)
+
+
 class CombinedGrade:
+    __slots__ = ('normal', 'extra')
+
     def __init__(self, normal=0, extra=0):
         self.normal = float(normal)
         self.extra = float(extra)
 
     @classmethod
     def from_string(cls, string):
-        splitted = string.split('+')
-        if len(splitted) <= 2:
-            return cls(*(x or 0 for x in splitted))
-
-        normal, extra, rest = splitted
-        if rest:
-            raise ValueError("More than one separator: %s", string)
-        return cls(normal, extra)
+        return cls(*split_grade(string))
 
     def __eq__(self, other):
         return self.normal == other.normal and self.extra == other.extra
@@ -64,35 +83,6 @@ class CombinedGrade:
     def __float__(self):
         return self.normal + self.extra
 
-    def __rsub__(self, other):
-        # we can assert that the other operand isn't a
-        # `CombinedGrade`, else it would supprt addition
-        return other - float(self)
-
-    def __sub__(self, other):
-        try:
-            return CombinedGrade(
-                normal=self.normal - other.normal,
-                extra=self.extra - other.extra,
-            )
-        except AttributeError:
-            return float(self) - other
-
-    def __le__(self, other):
-        try:
-            return self.normal <= other.normal and self.extra <= other.extra
-        except AttributeError:
-            return float(self) <= other
-
-    def __lt__(self, other):
-        try:
-            return self.normal < other.normal and self.extra < other.extra
-        except AttributeError:
-            return float(self) < other
-
-    def __float__(self):
-        return self.normal + self.extra
-
     def __repr__(self):
         if not self.extra:
             return '{}'.format(self.normal)
@@ -102,23 +92,298 @@ class CombinedGrade:
         return str(self).__format__(spec)
 
 
-def extract_grade_from_file(filename):
+class GradeVector:
+    """Many normal/extra pairs stored in two arrays of doubles.
+
+    Summing and comparing happen on the arrays, so no
+    :py:class:`CombinedGrade` is created per entry.
+    """
+    __slots__ = ('normal', 'extra')
+
+    def __init__(self, normal=(), extra=None):
+        self.normal = array('d', normal)
+        if extra is None:
+            self.extra = array('d', [0]) * len(self.normal)
+        else:
+            self.extra = array('d', extra)
+        if len(self.normal) != len(self.extra):
+            raise ValueError("Normal and extra points differ in length")
+
+    @classmethod
+    def from_strings(cls, strings):
+        """Parse grades like ``"8+2"``, see :py:func:`split_grade`"""
+        return cls.from_pairs(map(split_grade, strings))
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Collect ``(normal, extra)`` pairs like those of :py:func:`split_grade`"""
+        vector = cls()
+        for normal, extra in pairs:
+            vector.normal.append(normal)
+            vector.extra.append(extra)
+        return vector
+
+    @classmethod
+    def from_grades(cls, grades):
+        """Collect an iterable of :py:class:`CombinedGrade`"""
+        vector = cls()
+        for grade in grades:
+            vector.append(grade)
+        return vector
+
+    def append(self, grade):
+        self.normal.append(grade.normal)
+        self.extra.append(grade.extra)
+
+    def __len__(self):
+        return len(self.normal)
+
+    def __getitem__(self, index):
+        return CombinedGrade(self.normal[index], self.extra[index])
+
+    def __iter__(self):
+        return map(CombinedGrade, self.normal, self.extra)
+
+    def sum(self):
+        """Return the sum of all entries
+
+        :rtype: CombinedGrade
+        """
+        return CombinedGrade(fsum(self.normal), fsum(self.extra))
+
+    def totals(self):
+        """Return normal plus extra points of every entry
+
+        :rtype: array
+        """
+        return array('d', map(add, self.normal, self.extra))
+
+    def at_least(self, threshold):
+        """Compare the total points of every entry against a threshold
+
+        :returns: A list of booleans
+        :rtype: list
+        """
+        return [total >= threshold for total in self.totals()]
+
+    def __repr__(self):
+        return 'GradeVector([{}])'.format(', '.join(map(repr, self)))
+
+
+def extract_grade_pairs(filename):
+    """Parse the ``given/total`` grades of a grading file
+
+    :returns: The ``given`` and ``total`` grades as ``(normal, extra)``
+        pairs, see :py:func:`split_grade`, or ``None`` if the file has
+        no parseable result block
+    :rtype: tuple
+    """
     with open(filename) as fd:
         content = fd.read()
+    count('files opened')
+    count('bytes read', len(content))
 
     results = re.search(GRADE_REGEX, content)
+    if results is None:
+        return None
 
-    return {key: CombinedGrade.from_string(val.strip())
-            for key, val in results.groupdict().items()}
+    try:
+        return (split_grade(results.group('given').strip()),
+                split_grade(results.group('total').strip()))
+    except ValueError:
+        return None
 
 
-def grades_of_person(person):
-    for round_ in config.config_dict['rounds']:
-        filename = os.path.join(person, round_, 'grading.org')
+def extract_grade_from_file(filename):
+    """Parse the ``given/total`` grades of a grading file
+
+    :returns: A dict mapping ``'given'`` and ``'total'`` to
+        :py:class:`CombinedGrade`, or ``None`` if the file has no
+        parseable result block
+    """
+    pairs = extract_grade_pairs(filename)
+    if pairs is None:
+        return None
+    given, total = pairs
+    return {'given': CombinedGrade(*given), 'total': CombinedGrade(*total)}
+
+
+SCAN_JOBS = 8
+
+
+def _scan_person(person, rounds):
+    """Find the grading files of a person, in the order of ``rounds``
+
+    The person folder is listed once instead of probing every round.
+    """
+    try:
+        with os.scandir(person) as entries:
+            round_names = {entry.name for entry in entries if entry.is_dir()}
+    except FileNotFoundError:
+        return []
+
+    found = []
+    for round_ in rounds:
+        if round_ not in round_names:
+            continue
+        path = os.path.join(person, round_, GRADING_FILENAME)
         try:
-            yield round_, extract_grade_from_file(filename)
+            found.append((round_, path, os.stat(path)))
         except FileNotFoundError:
             continue
+    return found
+
+
+def scan_grading_tree(persons, rounds, jobs=SCAN_JOBS):
+    """Find all existing grading files, scanning person folders concurrently
+
+    :param persons: The person names
+    :param rounds: The round names
+    :param int jobs: The number of person folders scanned in parallel
+
+    :returns: A list of ``(person, [(round, path, stat), …])`` in the
+        order of ``persons``
+    :rtype: list
+    """
+    persons = list(persons)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(zip(persons, executor.map(partial(_scan_person, rounds=list(rounds)),
+                                              persons)))
+
+
+def extract_grade_pairs_from_files(filenames, jobs=SCAN_JOBS):
+    """Read and parse grading files concurrently
+
+    :returns: A list of results of :py:func:`extract_grade_pairs`
+    :rtype: list
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(extract_grade_pairs, filenames))
+
+
+GRADE_CACHE_FILENAME = '.grade-cache.sqlite'
+GRADE_CACHE_VERSION = 1
+# The grades are NULL for files without a result
+GRADE_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS grades (
+    path TEXT PRIMARY KEY,
+    person TEXT NOT NULL,
+    round TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    given_normal REAL,
+    given_extra REAL,
+    total_normal REAL,
+    total_extra REAL
+);
+CREATE INDEX IF NOT EXISTS grades_person_round ON grades (person, round);
+"""
+
+
+class GradeCache:
+    """A SQLite cache of the grades extracted from the grading files.
+
+    Every ``person/round/grading.org`` is stored with its mtime and
+    size and only parsed again if one of them changed.  Files without
+    a result, like untouched templates, are stored without grades, so
+    they are reported once and skipped afterwards.
+    """
+    def __init__(self, filename=GRADE_CACHE_FILENAME):
+        self.connection = sqlite3.connect(filename)
+        version, = self.connection.execute("PRAGMA user_version").fetchone()
+        if version != GRADE_CACHE_VERSION:
+            self.connection.executescript("DROP TABLE IF EXISTS grades; PRAGMA user_version = {};"
+                                          .format(GRADE_CACHE_VERSION))
+        self.connection.executescript(GRADE_CACHE_SCHEMA)
+
+    def sync(self, persons, rounds, jobs=SCAN_JOBS):
+        """Update the cache from the grading files
+
+        The tree is scanned by :py:func:`scan_grading_tree` and the
+        changed files are parsed concurrently.  Changed files without a
+        result are reported.
+
+        :param persons: The person names
+        :param rounds: The round names
+        :param int jobs: The number of parallel workers
+        """
+        known = {path: (mtime_ns, size) for path, mtime_ns, size
+                 in self.connection.execute("SELECT path, mtime_ns, size FROM grades")}
+        with span('marks.scan'):
+            found = [(person, round_, path, stat)
+                     for person, files in scan_grading_tree(persons, rounds, jobs)
+                     for round_, path, stat in files]
+        changed = [(person, round_, path, stat) for person, round_, path, stat in found
+                   if known.pop(path, None) != (stat.st_mtime_ns, stat.st_size)]
+        count('grade cache hits', len(found) - len(changed))
+        count('grade cache misses', len(changed))
+        with span('marks.parse'):
+            all_grades = extract_grade_pairs_from_files([path for _, _, path, _ in changed],
+                                                        jobs)
+
+        rows = []
+        for (person, round_, path, stat), grades in zip(changed, all_grades):
+            if grades is None:
+                print("No result in '{}', skipping it.".format(path))
+                rows.append((path, person, round_, stat.st_mtime_ns, stat.st_size,
+                             None, None, None, None))
+                continue
+            (given_normal, given_extra), (total_normal, total_extra) = grades
+            rows.append((path, person, round_, stat.st_mtime_ns, stat.st_size,
+                         given_normal, given_extra, total_normal, total_extra))
+
+        with span('marks.store'), self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO grades VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            # whatever is left has been deleted
+            self.connection.executemany("DELETE FROM grades WHERE path = ?",
+                                        ((path,) for path in known))
+
+    def grades_of_person(self, person):
+        """Return a dict mapping rounds to the ``given``/``total`` grades"""
+        return {round_: {'given': CombinedGrade(given_normal, given_extra),
+                         'total': CombinedGrade(total_normal, total_extra)}
+                for round_, given_normal, given_extra, total_normal, total_extra
+                in self.connection.execute(
+                    "SELECT round, given_normal, given_extra, total_normal, total_extra"
+                    " FROM grades WHERE person = ? AND given_normal IS NOT NULL",
+                    (person,))}
+
+    def grade_sums(self):
+        """Return a dict mapping persons to their summed ``(given, total)``"""
+        return {person: (CombinedGrade(given_normal, given_extra),
+                         CombinedGrade(total_normal, total_extra))
+                for person, given_normal, given_extra, total_normal, total_extra
+                in self.connection.execute(
+                    "SELECT person, SUM(given_normal), SUM(given_extra),"
+                    " SUM(total_normal), SUM(total_extra) FROM grades"
+                    " WHERE given_normal IS NOT NULL GROUP BY person")}
+
+    def all_grades(self):
+        """Return all cached grades as plain rows
+
+        :returns: A list of ``(person, round, given_normal, given_extra,
+            total_normal, total_extra)`` tuples
+        :rtype: list
+        """
+        return self.connection.execute(
+            "SELECT person, round, given_normal, given_extra, total_normal, total_extra"
+            " FROM grades WHERE given_normal IS NOT NULL").fetchall()
+
+
+@lru_cache(maxsize=None)
+def grade_cache():
+    """Return the :py:class:`GradeCache`, synced once per run"""
+    cache = GradeCache()
+    cache.sync(config.config_dict['persons'], config.config_dict['rounds'])
+    return cache
+
+
+def grades_of_person(person):
+    grades = grade_cache().grades_of_person(person)
+    for round_ in config.config_dict['rounds']:
+        if round_ in grades:
+            yield round_, grades[round_]
 
 
 def grades_of_everyone():
@@ -127,11 +392,7 @@ def grades_of_everyone():
 
 
 def person_grade_sum(person):
-    given, total = CombinedGrade(), CombinedGrade()
-    for _, result in grades_of_person(person):
-        given += result['given']
-        total += result['total']
-    return given, total
+    return grade_cache().grade_sums().get(person, (CombinedGrade(), CombinedGrade()))
 
 
 NEEDED = 78
@@ -161,8 +422,8 @@ def person_overview(person):
         overview += ''.join(CELL_FMT.format(item) for item in tuple_)
         overview += '\n'
 
-    sum_gotten = sum((x[1] for x in all_grades), CombinedGrade(0))
-    sum_total = sum((x[2] for x in all_grades), CombinedGrade(0))
+    sum_gotten = GradeVector.from_grades(x[1] for x in all_grades).sum()
+    sum_total = GradeVector.from_grades(x[2] for x in all_grades).sum()
 
     overview += '\n'
     overview += "You got {} out of (currently) {} points.\n".format(sum_gotten, sum_total)
@@ -182,7 +443,8 @@ def grades_overview(person=None, *a, **kw):
         print(person_overview(person, *a, **kw))
         exit(0)
 
+    sums = grade_cache().grade_sums()
     for person in config.config_dict['persons']:
-        given, total = person_grade_sum(person)
+        given, total = sums.get(person, (CombinedGrade(), CombinedGrade()))
         missing = NEEDED - float(given)
         print("{}: {} / {} ({} missing)".format(person, given, total, missing))
@@ -0,0 +1,86 @@
+"""
+
+repository.py
+~~~~~~~~~~~~~
+
+© Lukas Juhrich.
+
+"""
+import os
+import subprocess
+from contextlib import contextmanager
+
+
+class GitRepository:
+    """Batch the git operations of the grading folder.
+
+    Paths passed to :py:meth:`stage` are collected and added in a
+    single ``git add`` when the outermost :py:meth:`staging` block is
+    left, so that opening a round does not fork git for every file.
+    """
+    def __init__(self, path='.'):
+        self.path = path
+        self._pending = []
+        self._staging_depth = 0
+
+    def _git(self, *args, **kwargs):
+        """Run a git command in the repository
+
+        :returns: Whether it succeeded
+        :rtype: bool
+        """
+        try:
+            return subprocess.run(('git',) + args, cwd=self.path, check=False,
+                                  **kwargs).returncode == 0
+        except FileNotFoundError:
+            print("git not found.")
+            return False
+
+    def stage(self, path):
+        """Add a path to the next :py:meth:`flush`
+
+        Outside of a :py:meth:`staging` block, it is flushed at once.
+        """
+        self._pending.append(path)
+        if not self._staging_depth:
+            self.flush()
+
+    @contextmanager
+    def staging(self):
+        """Stage everything passed to :py:meth:`stage` in the end"""
+        self._staging_depth += 1
+        try:
+            yield self
+        finally:
+            self._staging_depth -= 1
+            if not self._staging_depth:
+                self.flush()
+
+    def flush(self):
+        """Stage the pending paths using one git process
+
+        :returns: Whether staging succeeded
+        :rtype: bool
+        """
+        if not self._pending:
+            return True
+        paths = b''.join(os.fsencode(path) + b'\0' for path in self._pending)
+        self._pending = []
+        return self._git('add', '--pathspec-from-file=-', '--pathspec-file-nul', input=paths)
+
+    def commit(self, message):
+        """Commit everything staged
+
+        :returns: Whether committing succeeded
+        :rtype: bool
+        """
+        self.flush()
+        return self._git('commit', '-q', '-m', message)
+
+    def tag(self, name):
+        """Tag ``HEAD``
+
+        :returns: Whether tagging succeeded
+        :rtype: bool
+        """
+        return self._git('tag', name)
@@ -0,0 +1,162 @@
+"""
+
+search.py
+~~~~~~~~~
+
+© Lukas Juhrich.
+
+"""
+import json
+import re
+from email.header import decode_header, make_header
+
+from atomic import dump_json
+from mail import INDEX_FILENAME, attempt_decoding, fetch_mails, mail_key, read_message
+
+
+SEARCH_INDEX_FILENAME = '.grade-search'
+SEARCH_INDEX_VERSION = 1
+
+RE_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(string):
+    """Split a string into a set of lowercase words
+
+    :param str string: The string to split
+
+    :rtype: set
+    """
+    return {token.lower() for token in RE_TOKEN.findall(string)}
+
+
+def decoded_header(value):
+    """Decode all encoded words of a header, leaving it as is on failure"""
+    try:
+        return str(make_header(decode_header(value)))
+    except (LookupError, UnicodeDecodeError, ValueError):
+        return str(value)
+
+
+def mail_tokens(mail, message):
+    """Return the words a mail can be found by
+
+    These are the words of the decoded sender and subject, the
+    attachment filenames, both as a whole and split into words, and
+    the words of the text parts.
+
+    :param mail: The index entry of the mail
+    :param Message message: The parsed mail
+
+    :rtype: set
+    """
+    tokens = tokenize(decoded_header(mail.sender))
+    tokens |= tokenize(decoded_header(mail.subject))
+
+    for part in message.walk():
+        filename = part.get_filename()
+        if filename:
+            tokens.add(filename.lower())
+            tokens |= tokenize(filename)
+        elif part.get_content_type() == 'text/plain':
+            try:
+                tokens |= tokenize(attempt_decoding(part.get_payload(decode=True)))
+            except UnicodeDecodeError:
+                continue
+    return tokens
+
+
+class SearchIndex:
+    """A persistent inverted index over the mailbox.
+
+    Every word maps to the keys (see :py:func:`mail.mail_key`) of the
+    mails containing it.  Using the keys instead of offsets keeps the
+    index valid if the mail index is rebuilt.
+    """
+    def __init__(self, filename=SEARCH_INDEX_FILENAME):
+        self.filename = filename
+        self.documents = set()
+        self.postings = {}
+        self._load_index()
+
+    def _load_index(self):
+        """Load :py:attr:`filename` if it exists"""
+        try:
+            with open(self.filename) as stream:
+                data = json.load(stream)
+        except (FileNotFoundError, ValueError):
+            return
+
+        if data.get('version') != SEARCH_INDEX_VERSION:
+            return
+        self.documents = set(data['documents'])
+        self.postings = {token: set(keys) for token, keys in data['postings'].items()}
+
+    def _write_index(self):
+        """Atomically dump the index to :py:attr:`filename`"""
+        data = {
+            'version': SEARCH_INDEX_VERSION,
+            'documents': sorted(self.documents),
+            'postings': {token: sorted(keys) for token, keys in self.postings.items()},
+        }
+        dump_json(data, self.filename)
+
+    def update(self, mails, path=None):
+        """Add the mails not indexed yet and save the index.
+
+        Only the new mails are read, at the offsets of the mail index.
+
+        :param list mails: The index entries, see
+            :py:func:`mail.fetch_mails`
+        :param str path: The mbox file, see :py:func:`mail.read_mail`
+
+        :returns: The number of mails added
+        :rtype: int
+        """
+        new_mails = [mail for mail in mails if mail_key(mail) not in self.documents]
+        for mail in new_mails:
+            key = mail_key(mail)
+            # not through ``message_cache``: every new mail is read once,
+            # so caching them would only evict the mails worth keeping
+            for token in mail_tokens(mail, read_message(mail, path)):
+                self.postings.setdefault(token, set()).add(key)
+            self.documents.add(key)
+
+        if new_mails:
+            self._write_index()
+        return len(new_mails)
+
+    def search(self, *words):
+        """Return the keys of the mails matching all words
+
+        A word matches if it has been indexed as a whole, like a
+        filename, or if all the words it consists of match.
+
+        :rtype: set
+        """
+        results = None
+        for word in words:
+            keys = self.postings.get(word.lower())
+            if keys is None:
+                token_keys = [self.postings.get(token, set()) for token in tokenize(word)]
+                keys = set.intersection(*token_keys) if token_keys else set()
+            results = keys if results is None else results & keys
+        return results or set()
+
+
+def search_mails(*words, index_filename=INDEX_FILENAME, filename=SEARCH_INDEX_FILENAME):
+    """Search the mailbox for mails containing all words
+
+    Mails not in the search index yet are read and indexed first, so
+    the first search after new mails arrived parses those.
+
+    :returns: The matching ``(index, mail)`` pairs, as numbered by
+        :py:func:`mail.fetch_mails`
+    :rtype: list
+    """
+    mails = fetch_mails(index_filename)
+    index = SearchIndex(filename)
+    index.update(mails)
+
+    keys = index.search(*words)
+    return [(i, mail) for i, mail in enumerate(mails) if mail_key(mail) in keys]
@@ -1,55 +1,164 @@
+import codecs
+import json
 import mimetypes
 import os
-from email import encoders
+import threading
+import time
+import uuid
+from base64 import encodebytes
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import repeat
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
-from smtplib import SMTP
+from email.policy import SMTP as SMTP_POLICY
+from smtplib import SMTP, SMTPDataError, SMTPException, SMTPRecipientsRefused, \
+    SMTPResponseException, SMTPSenderRefused, SMTPServerDisconnected
+from tempfile import SpooledTemporaryFile
 
+from atomic import dump_json
 from config import GLOBAL_FOLDER_NAME, GLOBAL_MAIL_NAME, GLOBAL_FILENAME, \
     GRADING_FILENAME, config
-from secret import pw as PASSWORD, login as USERNAME
+from timings import count, span
+
+
+# Multiple of the 57 bytes encoded into every line of base64
+ENCODE_CHUNK_SIZE = 57 * 1024
+# Mails larger than this are spooled to disk while being sent
+SPOOL_SIZE = 1024 * 1024
+
+
+def _is_utf8(path):
+    """Check whether a file is valid UTF-8, reading it in chunks"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(path, 'rb') as stream:
+            for chunk in iter(partial(stream.read, ENCODE_CHUNK_SIZE), b''):
+                decoder.decode(chunk)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+class FileAttachment:
+    """A file attached to a mail
+
+    The file is only read when the part is written, base64-encoding
+    it in chunks of :py:data:`ENCODE_CHUNK_SIZE`.
+
+    :param str path: The file
+    :param str content_type: The MIME type
+    :param str charset: The charset of a text file
+    """
+    def __init__(self, path, content_type, charset=None):
+        self.path = path
+        self.content_type = content_type
+        self.charset = charset
+
+    def headers(self):
+        """Return the serialized headers of the part
+
+        :rtype: bytes
+        """
+        maintype, subtype = self.content_type.split('/', 1)
+        part = MIMEBase(maintype, subtype)
+        if self.charset:
+            part.set_param('charset', self.charset)
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment',
+                        filename=os.path.basename(self.path))
+        return part.as_bytes(policy=SMTP_POLICY)
+
+    def write_to(self, stream):
+        """Write the part to a binary stream"""
+        stream.write(self.headers())
+        with open(self.path, 'rb') as file:
+            for chunk in iter(partial(file.read, ENCODE_CHUNK_SIZE), b''):
+                stream.write(encodebytes(chunk).replace(b'\n', b'\r\n'))
 
 
 def iter_folder_attachments(path):
-    """Yield the contents of `path` as MIME messages"""
-    for filename in os.listdir(path) if os.path.isdir(path) else []:
-        path = os.path.join(path, filename)
-        if not os.path.isfile(path) or path.endswith('~'):
+    """Yield the files of `path` as :py:class:`FileAttachment`"""
+    for filename in sorted(os.listdir(path)) if os.path.isdir(path) else []:
+        file_path = os.path.join(path, filename)
+        if not os.path.isfile(file_path) or filename.endswith('~'):
             continue
         # Guess the content type based on the file's extension.  Encoding
         # will be ignored, although we should check for simple things like
         # gzip'd or compressed files.
-        ctype, encoding = mimetypes.guess_type(path)
+        ctype, encoding = mimetypes.guess_type(file_path)
+        charset = None
+        if ctype and ctype.startswith('text/') and encoding is None:
+            if _is_utf8(file_path):
+                charset = 'utf-8'
+            else:
+                ctype = None
         if ctype is None or encoding is not None:
             # No guess could be made, or the file is encoded (compressed), so
             # use a generic bag-of-bits type.
             ctype = 'application/octet-stream'
-            maintype, subtype = ctype.split('/', 1)
-        if maintype == 'text':
-            with open(path) as fp:
-                # Note: we should handle calculating the charset
-                msg = MIMEText(fp.read(), _subtype=subtype)
-        else:
-            with open(path, 'rb') as fp:
-                msg = MIMEBase(maintype, subtype)
-                msg.set_payload(fp.read())
-                # Encode the payload using Base64
-            encoders.encode_base64(msg)
-            # Set the filename parameter
-        msg.add_header('Content-Disposition', 'attachment', filename=filename)
-        yield msg
+        yield FileAttachment(file_path, ctype, charset)
 
 
 DEFAULT_SENDER = "Lukas Juhrich <lukas.juhrich@tu-dresden.de>"
+SMTP_HOST = 'msx.tu-dresden.de'
+SMTP_PORT = 587
 
-def send_mail_to_person(person, subject, sender=DEFAULT_SENDER, attachments=None, args=None):
-    email = config.get_person_mail(person)
-    print("choosing mail:", email)
-    if not email:
-        print("{} has no Mail!".format(person))
-        exit(1)
+SEND_JOBS = 2
+# Mails per second, to stay below the limits of the server
+SEND_RATE = 1.0
+SENT_JOURNAL_NAME = '.sent'
+
+OUTBOX_FOLDER_NAME = 'outbox'
+OUTBOX_MANIFEST_NAME = 'manifest.json'
+OUTBOX_SUFFIX = '.eml'
+# Persons rendered by a process at once
+OUTBOX_CHUNK_SIZE = 8
 
+
+def _credentials():
+    """Read ``(login, password)`` from ``secret.py``"""
+    # the credentials are only needed when actually sending
+    from secret import pw as PASSWORD, login as USERNAME
+    return USERNAME, PASSWORD
+
+
+def connect(host=SMTP_HOST, port=SMTP_PORT, starttls=True, credentials=None):
+    """Open an SMTP connection and log in
+
+    :param bool starttls: Whether to run ``STARTTLS``
+    :param tuple credentials: ``(login, password)``.  ``None`` reads
+        them from ``secret.py``, ``False`` skips the login.
+
+    :rtype: SMTP
+    """
+    if credentials is None:
+        credentials = _credentials()
+    count('smtp connections')
+    connection = SMTP(host, port=port)
+    try:
+        if starttls:
+            connection.starttls()
+        if credentials:
+            connection.login(*credentials)
+    except BaseException:
+        connection.close()
+        raise
+    return connection
+
+
+def build_message(email, subject, sender=DEFAULT_SENDER, args=None):
+    """Build the headers of a multipart mail
+
+    The parts are written by :py:meth:`RoundMessageBuilder.write`.
+
+    :param str email: The recipient
+    :param dict args: Additional headers
+
+    :rtype: MIMEMultipart
+    """
     message = MIMEMultipart()
     message['From'] = sender
     message['CC'] = sender
@@ -59,18 +168,7 @@ def send_mail_to_person(person, subject, sender=DEFAULT_SENDER, attachments=None
     if args:
         for key, value in args.items():
             message[key] = value
-
-    for attachment in attachments:
-        message.attach(attachment)
-
-    s = SMTP('msx.tu-dresden.de', port=587)
-    # s.set_debuglevel(1)
-    s.starttls()
-    s.login(USERNAME, PASSWORD)
-    print("email:", email)
-    print("sender:", sender)
-    print("message:", message)
-    s.send_message(message, from_addr=sender, to_addrs=[email, sender])
+    return message
 
 
 def format_mail(person, round, email=None, sender=DEFAULT_SENDER):
@@ -81,24 +179,466 @@ def format_mail(person, round, email=None, sender=DEFAULT_SENDER):
             print("{} has no Mail!".format(person))
             exit(1)
 
-    attachments = []
-    mail_filename = os.path.join(GLOBAL_FOLDER_NAME, round, GLOBAL_MAIL_NAME)
-    with open(mail_filename) as file:
-        attachments.append(MIMEText(file.read()))
+    with RoundMessageBuilder(round, sender).spool(person, email) as stream:
+        s = connect()
+        print("email:", email)
+        print("sender:", sender)
+        send_spooled(s, sender, [email, sender], stream)
+        s.quit()
+
+
+class RoundMessageBuilder:
+    """Build the grading mails of a round.
+
+    The parts shared by everyone, ``mail.txt`` and ``remarks.org``, are
+    read, encoded and serialized once.  A mail is assembled from these
+    bytes and the serialized parts of the person.  The shared parts are
+    rebuilt if one of the files changes.
+
+    :param str round_name: The round
+    :param str sender: The sender
+    """
+    def __init__(self, round_name, sender=DEFAULT_SENDER):
+        self.round_name = round_name
+        self.sender = sender
+        self.shared_filenames = [os.path.join(GLOBAL_FOLDER_NAME, round_name, name)
+                                 for name in (GLOBAL_MAIL_NAME, GLOBAL_FILENAME)]
+        self._signature = None
+        self._shared = None
+        self._lock = threading.Lock()
+
+    def shared_parts(self):
+        """Return the serialized ``mail.txt`` and ``remarks.org`` parts
+
+        :rtype: list
+        """
+        with self._lock:
+            signature = [(stat.st_mtime_ns, stat.st_size)
+                         for stat in map(os.stat, self.shared_filenames)]
+            count('shared part cache hits' if signature == self._signature
+                  else 'shared part cache misses')
+            if signature != self._signature:
+                self._shared = []
+                for filename in self.shared_filenames:
+                    with open(filename) as file:
+                        self._shared.append(MIMEText(file.read()).as_bytes(policy=SMTP_POLICY))
+                self._signature = signature
+            return self._shared
+
+    def write(self, person, email, stream):
+        """Serialize the grading mail of a person to a binary stream
+
+        The parts are the ``mail.txt``, the ``grading.org`` of the
+        person, the ``remarks.org`` and the files in the person's
+        ``fixed`` folder, which are encoded while being written.
+        """
+        mail_part, remarks_part = self.shared_parts()
+        with open(os.path.join(person, self.round_name, GRADING_FILENAME)) as file:
+            grading_part = MIMEText(file.read()).as_bytes(policy=SMTP_POLICY)
+        parts = [mail_part, grading_part, remarks_part]
+
+        # base64 cannot contain the boundary, so only the text parts are checked
+        boundary = '=' * 15 + uuid.uuid4().hex + '=='
+        while any(boundary.encode() in part for part in parts):
+            boundary = '=' * 15 + uuid.uuid4().hex + '=='
+        message = build_message(email, "Bewertung {}".format(self.round_name), self.sender,
+                                args={'X-Grading-Round': self.round_name})
+        message.set_boundary(boundary)
+        delimiter = b'--' + boundary.encode()
+
+        stream.write(message.as_bytes(policy=SMTP_POLICY).partition(b'\r\n\r\n')[0])
+        stream.write(b'\r\n\r\n')
+        for part in parts:
+            stream.write(delimiter + b'\r\n' + part + b'\r\n')
+        for attachment in iter_folder_attachments(os.path.join(person, self.round_name, 'fixed')):
+            stream.write(delimiter + b'\r\n')
+            attachment.write_to(stream)
+            stream.write(b'\r\n')
+        stream.write(delimiter + b'--\r\n')
+
+    def spool(self, person, email):
+        """Serialize the grading mail of a person to a temporary file
+
+        The file stays in memory up to :py:data:`SPOOL_SIZE`.
+
+        :returns: The file, positioned at the start
+        :rtype: SpooledTemporaryFile
+        """
+        stream = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        with span('send_mail.render'):
+            self.write(person, email, stream)
+        stream.seek(0)
+        return stream
+
+
+def send_spooled(connection, from_addr, to_addrs, stream):
+    """Send a serialized mail from a binary stream
+
+    Like :py:meth:`SMTP.sendmail`, but the mail is sent line by line,
+    so it never has to be in memory as a whole.  The lines of the
+    stream have to end with CRLF.
+
+    :returns: The refused recipients, see :py:meth:`SMTP.sendmail`
+    :rtype: dict
+    """
+    connection.ehlo_or_helo_if_needed()
+    code, response = connection.mail(from_addr)
+    if code != 250:
+        connection.rset()
+        raise SMTPSenderRefused(code, response, from_addr)
+
+    refused = {}
+    for address in to_addrs:
+        code, response = connection.rcpt(address)
+        if code not in (250, 251):
+            refused[address] = (code, response)
+    if len(refused) == len(to_addrs):
+        connection.rset()
+        raise SMTPRecipientsRefused(refused)
+
+    code, response = connection.docmd('data')
+    if code != 354:
+        connection.rset()
+        raise SMTPDataError(code, response)
+
+    buffer = []
+    buffered = 0
+    sent = 0
+    line = b'\r\n'
+    for line in stream:
+        # dot-stuffing, see RFC 5321 4.5.2
+        if line.startswith(b'.'):
+            line = b'.' + line
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= ENCODE_CHUNK_SIZE:
+            connection.send(b''.join(buffer))
+            sent += buffered
+            buffer, buffered = [], 0
+    if not line.endswith(b'\r\n'):
+        buffer.append(b'\r\n')
+    buffer.append(b'.\r\n')
+    connection.send(b''.join(buffer))
+
+    code, response = connection.getreply()
+    if code != 250:
+        connection.rset()
+        raise SMTPDataError(code, response)
+    count('mails sent')
+    count('bytes sent', sent + buffered)
+    return refused
+
+
+class SMTPPool:
+    """Reuse a few SMTP connections across threads.
+
+    A connection is only used by one thread at a time.  New
+    connections are opened using ``connect`` when none is idle, so at
+    most as many exist as threads send concurrently.
+    """
+    def __init__(self, connect):
+        self._connect = connect
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _release(self, connection):
+        with self._lock:
+            self._idle.append(connection)
+
+    def send(self, stream, from_addr, to_addrs):
+        """Send a mail spooled to a binary stream over an idle connection
+
+        A connection the server has closed meanwhile is replaced once.
+        """
+        for retry in (True, False):
+            connection = self._acquire()
+            try:
+                stream.seek(0)
+                with span('send_mail.send'):
+                    send_spooled(connection, from_addr, to_addrs, stream)
+            except SMTPServerDisconnected:
+                connection.close()
+                if retry:
+                    continue
+                raise
+            except (SMTPResponseException, SMTPRecipientsRefused):
+                # the server rejected this message, the connection is fine
+                self._release(connection)
+                raise
+            except OSError:
+                connection.close()
+                raise
+            self._release(connection)
+            return
 
-    subject = "Bewertung {}".format(round)
+    def close(self):
+        """Quit all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            try:
+                connection.quit()
+            except (SMTPException, OSError):
+                connection.close()
 
-    specific_filename = os.path.join(person, round, GRADING_FILENAME)
-    with open(specific_filename) as file:
-        attachments.append(MIMEText(file.read()))
 
-    global_remarks_filename = os.path.join(GLOBAL_FOLDER_NAME, round, GLOBAL_FILENAME)
-    with open(global_remarks_filename) as file:
-        attachments.append(MIMEText(file.read()))
+class RateLimiter:
+    """Space out calls of :py:meth:`wait` across threads
 
-    for attachment in iter_folder_attachments(os.path.join(person, round, 'fixed')):
-        attachments.append(attachment)
+    :param float rate: The calls per second, or ``0`` for no limit
+    """
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
 
-    send_mail_to_person(person, subject, sender,
-                        attachments,
-                        args={'X-Grading-Round': round})
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+
+class DeliveryJournal:
+    """The persons a round has already been sent to.
+
+    Every delivery is appended to the file right away, so an
+    interrupted :py:func:`send_round` does not send twice.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        try:
+            with open(filename) as stream:
+                # ignore a line that is still being written
+                self.delivered = {line[:-1] for line in stream if line.endswith('\n')}
+        except FileNotFoundError:
+            self.delivered = set()
+
+    def record(self, person):
+        with self._lock:
+            with open(self.filename, 'a') as stream:
+                stream.write(person + '\n')
+                stream.flush()
+                os.fsync(stream.fileno())
+            self.delivered.add(person)
+
+
+def round_recipients(round_name, delivered=()):
+    """Find the persons a round's grading can be sent to
+
+    Persons without a mail address or a grading file are reported.
+
+    :param str round_name: The round
+    :param delivered: The persons to skip
+
+    :returns: A list of ``(person, email)`` pairs
+    :rtype: list
+    """
+    recipients = []
+    for person, email in config.config_dict['persons'].items():
+        if person in delivered:
+            continue
+        if not email:
+            print("{} has no Mail!".format(person))
+        elif not os.path.isfile(os.path.join(person, round_name, GRADING_FILENAME)):
+            print("{} has no grading for {}.".format(person, round_name))
+        else:
+            recipients.append((person, email))
+    return recipients
+
+
+def _send_all(mails, sender, jobs, rate, connection, sent):
+    """Send mails concurrently over a pool of SMTP connections
+
+    :param list mails: ``(person, to_addrs, open_stream)`` tuples,
+        where ``open_stream()`` returns the serialized mail as a
+        binary stream
+    :param connection: A callable opening a connection
+    :param sent: A callable called with every person sent to
+
+    :returns: The number of mails that could not be sent
+    :rtype: int
+    """
+    pool = SMTPPool(connection)
+    limiter = RateLimiter(rate)
+
+    def deliver(mail):
+        person, to_addrs, open_stream = mail
+        with open_stream() as stream:
+            limiter.wait()
+            try:
+                pool.send(stream, sender, to_addrs)
+            except OSError as e:
+                print("Could not send to {}: {}".format(person, e))
+                return False
+        sent(person)
+        print("Sent to", person)
+        return True
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(deliver, mails)).count(False)
+    finally:
+        pool.close()
+
+
+def round_journal(round_name):
+    return DeliveryJournal(os.path.join(GLOBAL_FOLDER_NAME, round_name, SENT_JOURNAL_NAME))
+
+
+def send_round(round_name=None, jobs=SEND_JOBS, rate=SEND_RATE, sender=DEFAULT_SENDER,
+               host=SMTP_HOST, port=SMTP_PORT, starttls=True, credentials=None):
+    """Send the grading mails of a round to everyone
+
+    The mails are sent by ``jobs`` threads sharing a pool of SMTP
+    connections.  Persons already sent to, as recorded in
+    :py:data:`SENT_JOURNAL_NAME` of the round, are skipped, so the
+    command can simply be run again after an interruption.
+
+    :param str round_name: The round.  Defaults to the current one.
+    :param int jobs: The number of concurrent connections
+    :param float rate: The mails per second, ``0`` for no limit
+    :param credentials: See :py:func:`connect`
+    """
+    round_name = round_name or config.current_round_name
+    journal = round_journal(round_name)
+    builder = RoundMessageBuilder(round_name, sender)
+
+    recipients = round_recipients(round_name, journal.delivered)
+    print("Sending {} mails, {} have been sent before."
+          .format(len(recipients), len(journal.delivered)))
+    if not recipients:
+        return
+
+    if credentials is None:
+        credentials = _credentials()
+    mails = [(person, [email, sender], partial(builder.spool, person, email))
+             for person, email in recipients]
+    failed = _send_all(mails, sender, jobs, rate,
+                       partial(connect, host, port, starttls, credentials), journal.record)
+    if failed:
+        print("{} mails could not be sent, run again to retry.".format(failed))
+        exit(1)
+
+
+def outbox_folder(round_name):
+    return os.path.join(GLOBAL_FOLDER_NAME, round_name, OUTBOX_FOLDER_NAME)
+
+
+# The builder of a rendering process, see :py:func:`render_round`
+_render_builder = None
+
+
+def _init_render_worker(round_name, sender):
+    global _render_builder  # pylint: disable=global-statement
+    _render_builder = RoundMessageBuilder(round_name, sender)
+
+
+def _render_mail(outbox, person, email):
+    """Render a mail into ``tmp`` of the outbox and move it to ``new``
+
+    :returns: The size of the mail
+    :rtype: int
+    """
+    filename = person + OUTBOX_SUFFIX
+    tmp_filename = os.path.join(outbox, 'tmp', filename)
+    with span('send_mail.render'), open(tmp_filename, 'wb') as stream:
+        _render_builder.write(person, email, stream)
+        size = stream.tell()
+    os.replace(tmp_filename, os.path.join(outbox, 'new', filename))
+    return size
+
+
+def render_round(round_name=None, jobs=None, sender=DEFAULT_SENDER):
+    """Render the grading mails of a round into its outbox
+
+    The outbox is a Maildir in the round's global folder.  The mails
+    are rendered by a pool of ``jobs`` processes into ``new`` as
+    ``<person>.eml`` and listed in :py:data:`OUTBOX_MANIFEST_NAME`
+    with their size and recipients.  Nothing is sent before
+    :py:func:`flush_outbox`, so they can be checked first.
+
+    :param str round_name: The round.  Defaults to the current one.
+    :param int jobs: The number of processes.  Defaults to the number
+        of CPUs.
+    """
+    round_name = round_name or config.current_round_name
+    recipients = round_recipients(round_name, round_journal(round_name).delivered)
+    outbox = outbox_folder(round_name)
+    for folder in ('tmp', 'new', 'cur'):
+        os.makedirs(os.path.join(outbox, folder), exist_ok=True)
+
+    persons = [person for person, _ in recipients]
+    emails = [email for _, email in recipients]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_render_worker,
+                             initargs=(round_name, sender)) as executor:
+        sizes = list(executor.map(_render_mail, repeat(outbox), persons, emails,
+                                  chunksize=OUTBOX_CHUNK_SIZE))
+
+    manifest = {
+        'round': round_name,
+        'sender': sender,
+        'mails': {person: {'filename': person + OUTBOX_SUFFIX, 'size': size,
+                           'recipients': [email, sender]}
+                  for person, email, size in zip(persons, emails, sizes)},
+    }
+    for filename in os.listdir(os.path.join(outbox, 'new')):
+        if filename[:-len(OUTBOX_SUFFIX)] not in manifest['mails']:
+            os.unlink(os.path.join(outbox, 'new', filename))
+
+    dump_json(manifest, os.path.join(outbox, OUTBOX_MANIFEST_NAME), indent=2)
+    print("Rendered {} mails ({} bytes) to {}.".format(len(sizes), sum(sizes), outbox))
+
+
+def flush_outbox(round_name=None, jobs=SEND_JOBS, rate=SEND_RATE, host=SMTP_HOST,
+                 port=SMTP_PORT, starttls=True, credentials=None):
+    """Send the mails rendered by :py:func:`render_round`
+
+    Sent mails are moved from ``new`` to ``cur`` and recorded in the
+    round's :py:data:`SENT_JOURNAL_NAME`, so flushing again after an
+    interruption only sends the rest.
+
+    :param str round_name: The round.  Defaults to the current one.
+    :param int jobs: The number of concurrent connections
+    :param float rate: The mails per second, ``0`` for no limit
+    :param credentials: See :py:func:`connect`
+    """
+    round_name = round_name or config.current_round_name
+    outbox = outbox_folder(round_name)
+    try:
+        with open(os.path.join(outbox, OUTBOX_MANIFEST_NAME)) as stream:
+            manifest = json.load(stream)
+    except FileNotFoundError:
+        print("No outbox for {}, run 'render_round' first.".format(round_name))
+        exit(1)
+
+    journal = round_journal(round_name)
+    mails = []
+    for person, entry in manifest['mails'].items():
+        filename = os.path.join(outbox, 'new', entry['filename'])
+        if person not in journal.delivered and os.path.isfile(filename):
+            mails.append((person, entry['recipients'], partial(open, filename, 'rb')))
+    print("Sending {} mails from {}.".format(len(mails), outbox))
+    if not mails:
+        return
+
+    def sent(person):
+        journal.record(person)
+        filename = manifest['mails'][person]['filename']
+        os.replace(os.path.join(outbox, 'new', filename), os.path.join(outbox, 'cur', filename))
+
+    if credentials is None:
+        credentials = _credentials()
+    failed = _send_all(mails, manifest['sender'], jobs, rate,
+                       partial(connect, host, port, starttls, credentials), sent)
+    if failed:
+        print("{} mails could not be sent, run again to retry.".format(failed))
+        exit(1)
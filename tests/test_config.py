@@ -0,0 +1,136 @@
+import os
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from config import (GLOBAL_FOLDER_NAME, GRADING_FILENAME, GRADING_TEMPLATE, GradingConfig,
+                    LazyConfig, prepare_persons_grading)
+
+
+class LazyConfigTestCase(TestCase):
+    def test_lazy(self):
+        with TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, '.grade')
+            config = LazyConfig(filename)
+            with open(filename, 'w') as stream:
+                stream.write("persons: {anna: anna@example.org}\nrounds: {}\n")
+            self.assertEqual(config.get_person_mail('anna'), 'anna@example.org')
+
+
+class BatchTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, '.grade')
+        self.config = GradingConfig(self.filename)
+        self.config.create_sample_config()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def reloaded(self):
+        return GradingConfig(self.filename).config_dict
+
+    def test_batch(self):
+        with self.config.batch():
+            self.config.add_person('anna', 'anna@example.org')
+            self.config.add_person('bert')
+            self.assertEqual(self.reloaded()['persons'], {})
+        self.assertEqual(self.reloaded()['persons'], {'anna': 'anna@example.org', 'bert': ''})
+
+    def test_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with self.config.batch():
+                self.config.add_person('anna')
+                raise RuntimeError
+        self.assertEqual(self.config.config_dict['persons'], {})
+        self.assertEqual(self.reloaded()['persons'], {})
+
+    def test_existing_person(self):
+        self.config.add_person('anna', 'anna@example.org')
+        self.config.add_person('anna')
+        self.assertEqual(self.config.get_person_mail('anna'), 'anna@example.org')
+
+    def test_journal(self):
+        with self.config.batch():
+            self.config._set(('journal',), True)
+        self.config.add_person('anna')
+        self.assertTrue(os.path.exists(self.config.journal_filename))
+        self.assertNotIn('anna', GradingConfig._load_yml_config(self.filename)['persons'])
+        self.assertIn('anna', self.reloaded()['persons'])
+
+        self.config.compact()
+        self.assertFalse(os.path.exists(self.config.journal_filename))
+        self.assertIn('anna', GradingConfig._load_yml_config(self.filename)['persons'])
+
+    def test_journal_values(self):
+        with self.config.batch():
+            self.config._set(('journal',), True)
+        opened = datetime(2016, 10, 10, 16, 40, 28)
+        with self.config.batch():
+            self.config._set(('persons', 'anna'), 'a\n\n    b')
+            self.config._set(('rounds', 'uebung01'), {'opened': opened})
+        config_dict = self.reloaded()
+        self.assertEqual(config_dict['persons']['anna'], 'a\n\n    b')
+        self.assertEqual(config_dict['rounds']['uebung01'], {'opened': opened})
+
+    def test_journal_partial_write(self):
+        with self.config.batch():
+            self.config._set(('journal',), True)
+        self.config.add_person('anna')
+        with open(self.config.journal_filename, 'a') as stream:
+            stream.write("---\n- - persons\n  - bert\n")
+        self.assertIn('anna', self.reloaded()['persons'])
+        self.assertNotIn('bert', self.reloaded()['persons'])
+
+
+class StagedPaths(list):
+    stage = list.append
+
+
+class PrepareGradingTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        for person in ('anna', 'bert'):
+            os.mkdir(person)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_template(self):
+        os.makedirs(os.path.join(GLOBAL_FOLDER_NAME, 'r1'))
+        with open(os.path.join(GLOBAL_FOLDER_NAME, 'r1', GRADING_FILENAME), 'w') as stream:
+            stream.write("custom template\n")
+
+        staged = StagedPaths()
+        prepare_persons_grading(['anna', 'bert'], 'r1', staged, jobs=2)
+        self.assertEqual(len(staged), 2)
+        with open(os.path.join('bert', 'r1', GRADING_FILENAME)) as stream:
+            self.assertEqual(stream.read(), "custom template\n")
+
+    def test_skip_unchanged(self):
+        prepare_persons_grading(['anna'], 'r1', StagedPaths())
+        os.mkdir('carl')
+        staged = StagedPaths()
+        prepare_persons_grading(['anna', 'bert', 'carl'], 'r1', staged)
+        self.assertEqual(sorted(staged), [os.path.join(person, 'r1', GRADING_FILENAME)
+                                          for person in ('bert', 'carl')])
+        with open(staged[0]) as stream:
+            self.assertEqual(stream.read(), GRADING_TEMPLATE)
+
+    def test_keep_graded(self):
+        os.makedirs(os.path.join(GLOBAL_FOLDER_NAME, 'r1'))
+        with open(os.path.join(GLOBAL_FOLDER_NAME, 'r1', GRADING_FILENAME), 'w') as stream:
+            stream.write("custom template\n")
+        prepare_persons_grading(['anna'], 'r1', StagedPaths())
+        filename = os.path.join('anna', 'r1', GRADING_FILENAME)
+        with open(filename, 'w') as stream:
+            stream.write("graded\n")
+
+        staged = StagedPaths()
+        prepare_persons_grading(['anna', 'bert'], 'r1', staged)
+        self.assertEqual(staged, [os.path.join('bert', 'r1', GRADING_FILENAME)])
+        with open(filename) as stream:
+            self.assertEqual(stream.read(), "graded\n")
@@ -0,0 +1,67 @@
+import csv
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from export import COLUMN_FIELDS, EXPORT_CSV_NAME, ColumnarExport
+
+
+class ColumnarExportTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.write('anna', 'r1', '7+1/10')
+        self.write('anna', 'r2', '5/10')
+        self.write('bert', 'r2', '3/10+2')
+        self.persons, self.rounds = ['anna', 'bert'], ['r1', 'r2']
+        self.assertEqual(ColumnarExport().update(self.persons, self.rounds, jobs=2),
+                         ['r1', 'r2'])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    @staticmethod
+    def write(person, round_, grade):
+        os.makedirs(os.path.join(person, round_), exist_ok=True)
+        filename = os.path.join(person, round_, 'grading.org')
+        with open(filename, 'w') as stream:
+            stream.write("#+BEGIN_RESULT\n{}\n#+END_RESULT\n".format(grade))
+        stat = os.stat(filename)
+        # make the change visible even with a coarse mtime resolution
+        os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    @staticmethod
+    def read_csv():
+        with open(os.path.join('export', EXPORT_CSV_NAME)) as stream:
+            return list(csv.reader(stream))
+
+    def test_csv(self):
+        header, anna, bert = self.read_csv()
+        self.assertEqual(header[:3], ['person', 'r1 given', 'r1 total'])
+        self.assertEqual(anna[:3], ['anna', '8.0', '10.0'])
+        # bert did not submit r1
+        empty = len(COLUMN_FIELDS) + 1
+        self.assertEqual(bert[:empty + 2], ['bert'] + [''] * empty + ['3.0'])
+
+    def test_unchanged(self):
+        self.assertEqual(ColumnarExport().update(self.persons, self.rounds), [])
+
+    def test_changed_round(self):
+        self.write('bert', 'r1', '9/10')
+        self.assertEqual(ColumnarExport().update(self.persons, self.rounds), ['r1'])
+        self.assertEqual(self.read_csv()[2][1], '9.0')
+
+    def test_changed_persons(self):
+        self.assertEqual(ColumnarExport().update(['anna', 'bert', 'carl'], self.rounds),
+                         ['r1', 'r2'])
+        self.assertEqual([row[0] for row in self.read_csv()[1:]], ['anna', 'bert', 'carl'])
+
+    def test_removed_round(self):
+        export = ColumnarExport()
+        self.assertEqual(export.update(self.persons, ['r2']), [])
+        for field in COLUMN_FIELDS:
+            self.assertFalse(os.path.exists(export.column_filename('r1', field)))
+            self.assertTrue(os.path.exists(export.column_filename('r2', field)))
+        self.assertFalse(any(column.startswith('r1') for column in self.read_csv()[0]))
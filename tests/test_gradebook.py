@@ -0,0 +1,73 @@
+from unittest import TestCase
+
+import numpy as np
+
+from gradebook import EXTRA, NORMAL, Gradebook, _format_number
+
+PERSONS = ['anna', 'bert', 'carl']
+ROUNDS = ['r1', 'r2', 'r3']
+# (person, round, given_normal, given_extra, total_normal, total_extra)
+ROWS = [
+    ('anna', 'r1', 8, 1, 10, 2),
+    ('anna', 'r2', 6, 0, 10, 0),
+    ('bert', 'r1', 4, 0, 10, 2),
+    ('carl', 'r1', 10, 2, 10, 2),
+    ('dora', 'r1', 1, 0, 10, 0),
+    ('anna', 'r9', 1, 0, 10, 0),
+]
+
+
+class GradebookTestCase(TestCase):
+    def setUp(self):
+        self.gradebook = Gradebook.from_rows(PERSONS, ROUNDS, ROWS)
+
+    def test_from_rows(self):
+        self.assertEqual(self.gradebook.given.shape, (2, 3, 3))
+        self.assertEqual(self.gradebook.given[NORMAL, 0, 0], 8)
+        self.assertEqual(self.gradebook.given[EXTRA, 0, 0], 1)
+        self.assertEqual(self.gradebook.total[EXTRA, 2, 0], 2)
+        self.assertEqual(self.gradebook.submitted.tolist(),
+                         [[True, True, False], [True, False, False], [True, False, False]])
+        self.assertEqual(self.gradebook.person_sums.tolist(), [15, 4, 12])
+
+    def test_empty(self):
+        gradebook = Gradebook.from_rows(PERSONS, ROUNDS, [])
+        self.assertFalse(gradebook.submitted.any())
+        self.assertTrue(np.isnan(gradebook.round_statistics()['mean']).all())
+
+    def test_round_statistics(self):
+        statistics = self.gradebook.round_statistics(percentiles=(50,))
+        self.assertEqual(statistics['count'].tolist(), [3, 1, 0])
+        self.assertEqual(statistics['mean'][0], 25 / 3)
+        self.assertEqual(statistics['median'][:2].tolist(), [9, 6])
+        self.assertEqual(statistics[50][0], 9)
+        # no submissions for r3
+        self.assertTrue(np.isnan(statistics['mean'][2]))
+        self.assertTrue(np.isnan(statistics['median'][2]))
+        self.assertTrue(np.isnan(statistics[50][2]))
+
+    def test_on_track(self):
+        self.assertEqual(self.gradebook.on_track().tolist(), [False, False, False])
+        # anna: 15 points and 2 submissions in 3 rounds
+        self.assertEqual(self.gradebook.on_track(rounds_planned=16).tolist(),
+                         [True, False, False])
+        self.assertEqual(Gradebook.from_rows(PERSONS, [], []).on_track().tolist(),
+                         [False, False, False])
+
+    def test_outlier_rounds(self):
+        rows = [(person, round_, 5, 0, 10, 0) for person in PERSONS for round_ in ROUNDS]
+        gradebook = Gradebook.from_rows(PERSONS, ROUNDS, rows)
+        # all rounds alike, the standard deviation is 0
+        self.assertEqual(gradebook.outlier_rounds(), [])
+
+        rounds = ['r{}'.format(j) for j in range(10)]
+        rows = [(person, round_, 9 if round_ == 'r4' else 5, 0, 10, 0)
+                for person in PERSONS for round_ in rounds]
+        gradebook = Gradebook.from_rows(PERSONS, rounds, rows)
+        self.assertEqual(gradebook.outlier_rounds(), ['r4'])
+
+    def test_format_number(self):
+        statistics = self.gradebook.round_statistics()
+        self.assertEqual(_format_number(statistics['count'][0]), "3")
+        self.assertEqual(_format_number(statistics['mean'][1]), "6.0")
+        self.assertEqual(_format_number(statistics['mean'][2]), "-")
@@ -1,9 +1,17 @@
+import hashlib
+import os
 import re
 from datetime import datetime
 from collections import deque
+from email.mime.application import MIMEApplication
+from email.mime.text import MIMEText
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 
-from mail import DATE_FORMAT, grab_one_mail, iter_mails
+from attachment_store import AttachmentStore, SubmissionManifest
+from mail import DATE_FORMAT, MailIndex, MailSources, MessageCache, _indexed_mail, grab_one_mail, \
+    header_block, iter_decoded_payload, iter_mail_views, iter_mails, mail_key, read_mail, \
+    save_attachment
 
 
 SAMPLE_DATE = "Mon Oct 10 16:40:28 2016"
@@ -43,3 +51,252 @@ class IterMailsTestCase(TestCase):
         self.assertEqual(mails[0].date, '2')
         self.assertEqual(mails[1].content, "zwei")
         self.assertEqual(mails[1].date, '2')
+
+
+SAMPLE_MBOX = (b"From - Mon Oct 10 16:40:28 2016\n"
+               b"Subject: eins\nMessage-ID: <eins@example.org>\n\nfirst\n"
+               b"From - Tue Oct 11 09:00:00 2016\r\n"
+               b"Subject: zwei\r\n\r\n\xfcber\r\n")
+
+
+class IterMailViewsTestCase(TestCase):
+    def test_views(self):
+        views = list(iter_mail_views(SAMPLE_MBOX))
+        self.assertEqual(len(views), 2)
+        self.assertEqual(views[0].date, datetime(2016, 10, 10, 16, 40, 28))
+        first = SAMPLE_MBOX[views[0].offset:views[0].offset + views[0].length]
+        self.assertEqual(first, b"Subject: eins\nMessage-ID: <eins@example.org>\n\nfirst\n")
+
+    def test_not_utf8(self):
+        last = list(iter_mail_views(SAMPLE_MBOX))[-1]
+        content = SAMPLE_MBOX[last.offset:last.offset + last.length]
+        self.assertEqual(content, b"Subject: zwei\r\n\r\n\xfcber\r\n")
+        self.assertEqual(last.offset + last.length, len(SAMPLE_MBOX))
+
+    def test_start(self):
+        views = list(iter_mail_views(SAMPLE_MBOX, start=1))
+        self.assertEqual(len(views), 1)
+        self.assertEqual(views[0].date.day, 11)
+
+    def test_empty(self):
+        self.assertEqual(list(iter_mail_views(b'')), [])
+
+
+class HeaderBlockTestCase(TestCase):
+    def test_header_block(self):
+        first, last = iter_mail_views(SAMPLE_MBOX)
+        self.assertEqual(header_block(SAMPLE_MBOX, first),
+                         b"Subject: eins\nMessage-ID: <eins@example.org>\n\n")
+        self.assertEqual(header_block(SAMPLE_MBOX, last), b"Subject: zwei\r\n\r\n")
+
+    def test_no_body(self):
+        view = next(iter_mail_views(b"From - Mon Oct 10 16:40:28 2016\nSubject: x\n"))
+        self.assertEqual(header_block(b"From - Mon Oct 10 16:40:28 2016\nSubject: x\n", view),
+                         b"Subject: x\n")
+
+
+class MailIndexTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.mailbox = os.path.join(self.tmp.name, 'Inbox')
+        self.filename = os.path.join(self.tmp.name, '.grade-index')
+        self.write_mailbox(SAMPLE_MBOX)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_mailbox(self, content, mode='wb'):
+        with open(self.mailbox, mode) as desc:
+            desc.write(content)
+
+    def fresh_index(self):
+        index = MailIndex(self.mailbox, self.filename)
+        index.update()
+        return index
+
+    def test_index(self):
+        index = self.fresh_index()
+        self.assertEqual([m.subject for m in index.mails], ['eins', 'zwei'])
+        self.assertEqual([mail_key(m) for m in index.mails],
+                         ['<eins@example.org>', '2016-10-11T09:00:00|<no sender>'])
+        self.assertEqual(read_mail(index.mails[0], self.mailbox),
+                         b"Subject: eins\nMessage-ID: <eins@example.org>\n\nfirst\n")
+
+    def test_persistent(self):
+        self.fresh_index()
+        index = MailIndex(self.mailbox, self.filename)
+        self.assertEqual(len(index.mails), 2)
+        self.assertFalse(index.update())
+
+    def test_append(self):
+        self.fresh_index()
+        self.write_mailbox(b"From - Sun Oct 09 08:00:00 2016\nSubject: null\n\n", 'ab')
+        os.utime(self.mailbox, (0, 0))
+        index = self.fresh_index()
+        self.assertEqual([m.subject for m in index.mails], ['null', 'eins', 'zwei'])
+        self.assertEqual(read_mail(index.mails[2], self.mailbox),
+                         b"Subject: zwei\r\n\r\n\xfcber\r\n")
+
+    def test_shrink(self):
+        self.fresh_index()
+        self.write_mailbox(b"From - Sun Oct 09 08:00:00 2016\nSubject: null\n\n")
+        index = self.fresh_index()
+        self.assertEqual([m.subject for m in index.mails], ['null'])
+
+
+class MailSourcesTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.inbox = os.path.join(self.tmp.name, 'Inbox')
+        with open(self.inbox, 'wb') as desc:
+            desc.write(SAMPLE_MBOX)
+        self.maildir = os.path.join(self.tmp.name, 'Maildir')
+        for folder in ('new', 'cur', 'tmp'):
+            os.makedirs(os.path.join(self.maildir, folder))
+        self.write_maildir('new', '1.unique', "Date: Mon, 10 Oct 2016 23:00:00 -0000\n"
+                           "Subject: drei\n\nthird\n")
+        self.filename = os.path.join(self.tmp.name, '.grade-index')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_maildir(self, folder, name, content):
+        with open(os.path.join(self.maildir, folder, name), 'w') as desc:
+            desc.write(content)
+
+    def sources(self):
+        sources = MailSources([self.inbox, self.maildir], self.filename)
+        sources.update()
+        return sources
+
+    def test_merge(self):
+        mails = list(self.sources().iter_mails())
+        self.assertEqual([m.subject for m in mails], ['eins', 'drei', 'zwei'])
+        self.assertEqual(read_mail(mails[1]), b"Date: Mon, 10 Oct 2016 23:00:00 -0000\n"
+                                              b"Subject: drei\n\nthird\n")
+        self.assertEqual(read_mail(mails[2]), b"Subject: zwei\r\n\r\n\xfcber\r\n")
+
+    def test_maildir_flags(self):
+        self.sources()
+        os.rename(os.path.join(self.maildir, 'new', '1.unique'),
+                  os.path.join(self.maildir, 'cur', '1.unique:2,S'))
+        sources = MailSources([self.inbox, self.maildir], self.filename)
+        self.assertTrue(sources.update())
+        self.assertFalse(sources.update())
+        mail = list(sources.iter_mails())[1]
+        self.assertEqual(mail.subject, 'drei')
+        self.assertTrue(read_mail(mail).endswith(b"third\n"))
+
+    def test_stable_ties(self):
+        self.write_maildir('new', '2.unique', "Subject: vier\n\n")
+        os.utime(os.path.join(self.maildir, 'new', '2.unique'),
+                 (0, datetime(2016, 10, 11, 9).timestamp()))
+        subjects = [m.subject for m in self.sources().iter_mails()]
+        self.assertEqual(subjects, ['eins', 'drei', 'zwei', 'vier'])
+
+    def test_maildir_ties(self):
+        self.write_maildir('new', '0.unique', "Date: Mon, 10 Oct 2016 23:00:00 -0000\n"
+                           "Subject: null\n\n")
+        subjects = [m.subject for m in self.sources().iter_mails()]
+        self.assertEqual(subjects, ['eins', 'null', 'drei', 'zwei'])
+
+        # 'cur/1.unique:2,S' sorts before 'new/0.unique'
+        os.rename(os.path.join(self.maildir, 'new', '1.unique'),
+                  os.path.join(self.maildir, 'cur', '1.unique:2,S'))
+        self.assertEqual([m.subject for m in self.sources().iter_mails()], subjects)
+        sources = MailSources([self.inbox, self.maildir], self.filename)
+        self.assertEqual([m.subject for m in sources.iter_mails()], subjects)
+
+
+class MessageCacheTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.mailbox = os.path.join(self.tmp.name, 'Inbox')
+        with open(self.mailbox, 'wb') as desc:
+            desc.write(SAMPLE_MBOX)
+        self.views = list(iter_mail_views(SAMPLE_MBOX))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_hit(self):
+        cache = MessageCache()
+        first = cache.get(self.views[0], self.mailbox)
+        self.assertIs(cache.get(self.views[0], self.mailbox), first)
+        self.assertEqual(first['Subject'], 'eins')
+        self.assertEqual(cache.cache_info()[:2], (1, 1))
+
+    def test_bounded(self):
+        cache = MessageCache(maxsize=1)
+        cache.get(self.views[0], self.mailbox)
+        cache.get(self.views[1], self.mailbox)
+        cache.get(self.views[0], self.mailbox)
+        self.assertEqual(cache.cache_info(), (0, 3, 1, 1))
+
+
+SAMPLE_PAYLOAD = bytes(range(256)) * 41
+
+
+class DecodePayloadTestCase(TestCase):
+    def assert_chunked_decoding(self, part):
+        for chunk_size in (1, 7, 76, 1000, 100000):
+            decoded = b''.join(iter_decoded_payload(part, chunk_size=chunk_size))
+            self.assertEqual(decoded, part.get_payload(decode=True))
+
+    def test_base64(self):
+        self.assert_chunked_decoding(MIMEApplication(SAMPLE_PAYLOAD))
+
+    def test_quoted_printable(self):
+        part = MIMEText("Grüße, " * 100 + "\nzweite Zeile\n", _charset='latin-1')
+        self.assertEqual(part['Content-Transfer-Encoding'], 'quoted-printable')
+        self.assert_chunked_decoding(part)
+
+    def test_7bit(self):
+        self.assert_chunked_decoding(MIMEText("plain\ntext\n"))
+
+
+class SaveAttachmentTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.store = AttachmentStore(os.path.join(self.tmp.name, '.attachments'))
+        self.path = os.path.join(self.tmp.name, 'person', 'round')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @staticmethod
+    def attachment(payload):
+        part = MIMEApplication(payload)
+        part.add_header('Content-Disposition', 'attachment', filename='data.bin')
+        return part
+
+    @staticmethod
+    def mail(day):
+        return _indexed_mail(datetime(2016, 10, day), 0, 0, '', '', '<{}@example.org>'.format(day))
+
+    def read(self, path):
+        with open(path, 'rb') as fd:
+            return fd.read()
+
+    def test_save(self):
+        saved = save_attachment(self.attachment(SAMPLE_PAYLOAD), path=self.path, store=self.store)
+        self.assertEqual(self.read(saved.path), SAMPLE_PAYLOAD)
+        self.assertEqual(os.listdir(self.path), ['data.bin'])
+        self.assertEqual(saved.size, len(SAMPLE_PAYLOAD))
+        self.assertEqual(saved.checksum, hashlib.sha256(SAMPLE_PAYLOAD).hexdigest())
+
+    def test_dedup(self):
+        first = save_attachment(self.attachment(SAMPLE_PAYLOAD), path=self.path, store=self.store)
+        other = os.path.join(self.tmp.name, 'other', 'round')
+        second = save_attachment(self.attachment(SAMPLE_PAYLOAD), path=other, store=self.store)
+        self.assertTrue(os.path.samefile(first.path, second.path))
+        self.assertEqual(len(os.listdir(self.store.root)), 1)
+
+    def test_latest_wins(self):
+        save_attachment(self.attachment(b'new'), path=self.path, mail=self.mail(11),
+                        store=self.store)
+        saved = save_attachment(self.attachment(b'old'), path=self.path, mail=self.mail(10),
+                                store=self.store)
+        self.assertEqual(self.read(saved.path), b'new')
+        self.assertEqual(SubmissionManifest(self.path).latest('data.bin')['mail'],
+                         '<11@example.org>')
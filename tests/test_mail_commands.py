@@ -0,0 +1,91 @@
+import os
+from contextlib import redirect_stdout
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from config import GradingConfig
+from mail import DATE_FORMAT
+from mail_commands import save_all_attachments
+
+
+def submission(date, sender, message_id, filename):
+    """Build an mbox entry with one attachment"""
+    message = MIMEMultipart()
+    message['From'] = sender
+    message['Subject'] = "Abgabe"
+    message['Message-ID'] = message_id
+    message.attach(MIMEText("Hallo\n"))
+    attachment = MIMEText("print({!r})\n".format(filename))
+    attachment.add_header('Content-Disposition', 'attachment', filename=filename)
+    message.attach(attachment)
+    return "From - {}\n".format(date.strftime(DATE_FORMAT)).encode() + message.as_bytes()
+
+
+class SaveAllTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+        with open('Inbox', 'wb') as stream:
+            stream.write(submission(datetime(2016, 10, 9, 12), "anna@example.org",
+                                    "<early@example.org>", "early.py"))
+            stream.write(submission(datetime(2016, 10, 11, 12), "Anna S. <Anna@Example.ORG>",
+                                    "<anna@example.org>", "aufgabe1.py"))
+            stream.write(submission(datetime(2016, 10, 11, 13), "Eve <eve@example.org>",
+                                    "<eve@example.org>", "aufgabe1.py"))
+
+        self.config = GradingConfig()
+        self.config.create_sample_config()
+        with self.config.batch():
+            self.config.add_person('anna', 'anna@EXAMPLE.org')
+            self.config.add_person('bert', 'bert@example.org')
+            self.config._set(('rounds', 'r1'), {'opened': datetime(2016, 10, 10)})
+            self.config._set(('mailboxes',), [os.path.join(self.tmp.name, 'Inbox')])
+        os.mkdir('anna')
+        os.mkdir('bert')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def save_all(self):
+        with patch('mail_commands.config', self.config), patch('config.config', self.config), \
+                redirect_stdout(StringIO()) as output:
+            save_all_attachments(jobs=2)
+        return output.getvalue()
+
+    def test_save_all(self):
+        output = self.save_all()
+        self.assertIn("Saved 1 of 2 new mails.", output)
+        self.assertEqual(sorted(os.listdir(os.path.join('anna', 'r1'))),
+                         ['.submissions.json', 'aufgabe1.py'])
+        self.assertFalse(os.path.exists(os.path.join('bert', 'r1')))
+        # the unknown sender is listed, but not saved
+        self.assertIn("Unknown senders:", output)
+        self.assertIn("eve@example.org", output)
+        self.assertEqual(self.config.processed_mails('r1'), {'<anna@example.org>'})
+
+    def test_second_run(self):
+        self.save_all()
+        os.unlink(os.path.join('anna', 'r1', 'aufgabe1.py'))
+        output = self.save_all()
+        self.assertIn("Saved 0 of 1 new mails.", output)
+        self.assertFalse(os.path.exists(os.path.join('anna', 'r1', 'aufgabe1.py')))
+        self.assertEqual(GradingConfig().processed_mails('r1'), {'<anna@example.org>'})
+
+
+class PersonsByAddressTestCase(TestCase):
+    def test_persons_by_address(self):
+        with TemporaryDirectory() as tmp:
+            config = GradingConfig(os.path.join(tmp, '.grade'))
+            config.create_sample_config()
+            config.add_person('anna', 'Anna <Anna@Example.org>, anna@uni.example.org')
+            config.add_person('bert')
+            self.assertEqual(config.persons_by_address(), {'anna@example.org': 'anna',
+                                                           'anna@uni.example.org': 'anna'})
@@ -0,0 +1,172 @@
+import os
+from contextlib import redirect_stdout
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from config import GRADING_TEMPLATE
+from marks import CombinedGrade, GradeCache, GradeVector, _scan_person, extract_grade_from_file, \
+    extract_grade_pairs_from_files, scan_grading_tree, split_grade
+
+
+class CombinedGradeTestCase(TestCase):
+    def test_from_string(self):
+        self.assertEqual(CombinedGrade.from_string("8+2"), CombinedGrade(8, 2))
+        self.assertEqual(CombinedGrade.from_string("8"), CombinedGrade(8))
+        self.assertEqual(CombinedGrade.from_string("+2"), CombinedGrade(0, 2))
+        with self.assertRaises(ValueError):
+            split_grade("1+2+3")
+
+    def test_arithmetic(self):
+        grade = CombinedGrade(8, 2)
+        grade += CombinedGrade(1, 1)
+        self.assertEqual(grade, CombinedGrade(9, 3))
+        self.assertEqual(20 - grade, 8)
+        self.assertTrue(grade < 13)
+        self.assertFalse(hasattr(grade, '__dict__'))
+
+
+class GradeVectorTestCase(TestCase):
+    def test_from_strings(self):
+        vector = GradeVector.from_strings(["8+2", "5", "", "3+"])
+        self.assertEqual(len(vector), 4)
+        self.assertEqual(vector[0], CombinedGrade(8, 2))
+        self.assertEqual(vector.sum(), CombinedGrade(16, 2))
+        self.assertEqual(list(vector.totals()), [10, 5, 0, 3])
+        self.assertEqual(vector.at_least(5), [True, True, False, False])
+
+    def test_from_pairs(self):
+        vector = GradeVector.from_pairs([(8, 2), (5, 0)])
+        self.assertEqual(list(vector.normal), [8, 5])
+        self.assertEqual(list(vector.extra), [2, 0])
+        self.assertEqual(len(GradeVector.from_pairs([])), 0)
+
+    def test_from_grades(self):
+        grades = [CombinedGrade(1, 2), CombinedGrade(3)]
+        self.assertEqual(list(GradeVector.from_grades(grades)), grades)
+
+
+class ExtractGradeTestCase(TestCase):
+    def test_extract(self):
+        with TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'grading.org')
+            with open(filename, 'w') as stream:
+                stream.write("* Bewertung\n\n#+BEGIN_RESULT\n7+1/10\n#+END_RESULT\n")
+            grades = extract_grade_from_file(filename)
+        self.assertEqual(grades, {'given': CombinedGrade(7, 1), 'total': CombinedGrade(10)})
+
+    def test_without_result(self):
+        with TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'grading.org')
+            with open(filename, 'w') as stream:
+                stream.write(GRADING_TEMPLATE)
+            self.assertIsNone(extract_grade_from_file(filename))
+
+
+class ScanTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        # anna graded in r1 and r3, bert has an r1 folder without a
+        # grading file, carl has no folder at all
+        for person, round_ in (('anna', 'r1'), ('anna', 'r3'), ('bert', 'r1')):
+            os.makedirs(os.path.join(person, round_))
+        for round_, grade in (('r1', '7/10'), ('r3', '5+1/10')):
+            with open(os.path.join('anna', round_, 'grading.org'), 'w') as stream:
+                stream.write("#+BEGIN_RESULT\n{}\n#+END_RESULT\n".format(grade))
+        with open(os.path.join('anna', 'notes.txt'), 'w') as stream:
+            stream.write("not a round\n")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_scan_person(self):
+        found = _scan_person('anna', ['r3', 'r2', 'r1'])
+        self.assertEqual([(round_, path) for round_, path, _ in found],
+                         [('r3', os.path.join('anna', 'r3', 'grading.org')),
+                          ('r1', os.path.join('anna', 'r1', 'grading.org'))])
+        self.assertEqual(_scan_person('bert', ['r1']), [])
+        self.assertEqual(_scan_person('carl', ['r1']), [])
+
+    def test_scan_tree(self):
+        scanned = scan_grading_tree(['carl', 'bert', 'anna'], ['r1', 'r2', 'r3'], jobs=2)
+        self.assertEqual([(person, [round_ for round_, _, _ in files])
+                          for person, files in scanned],
+                         [('carl', []), ('bert', []), ('anna', ['r1', 'r3'])])
+        paths = [path for _, files in scanned for _, path, _ in files]
+        self.assertEqual(extract_grade_pairs_from_files(paths, jobs=2),
+                         [((7, 0), (10, 0)), ((5, 1), (10, 0))])
+
+
+class GradeCacheTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.cache = GradeCache(os.path.join(self.tmp.name, 'cache.sqlite'))
+
+    def tearDown(self):
+        self.cache.connection.close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    @staticmethod
+    def write(person, round_, grade):
+        os.makedirs(os.path.join(person, round_), exist_ok=True)
+        filename = os.path.join(person, round_, 'grading.org')
+        with open(filename, 'w') as stream:
+            stream.write("* Ergebnis\n\n#+BEGIN_RESULT\n{}\n#+END_RESULT\n".format(grade))
+        return filename
+
+    def test_sync(self):
+        self.write('anna', 'r1', '7+1/10')
+        self.write('anna', 'r2', '5/10+2')
+        self.write('bert', 'r1', '3/10')
+        self.cache.sync(['anna', 'bert', 'carl'], ['r1', 'r2'])
+        self.assertEqual(self.cache.grades_of_person('bert'),
+                         {'r1': {'given': CombinedGrade(3), 'total': CombinedGrade(10)}})
+        self.assertEqual(self.cache.grade_sums(), {
+            'anna': (CombinedGrade(12, 1), CombinedGrade(20, 2)),
+            'bert': (CombinedGrade(3), CombinedGrade(10)),
+        })
+
+    def test_changed_file(self):
+        filename = self.write('anna', 'r1', '7/10')
+        self.cache.sync(['anna'], ['r1'])
+
+        # same size, newer mtime
+        self.write('anna', 'r1', '8/10')
+        stat = os.stat(filename)
+        os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.cache.sync(['anna'], ['r1'])
+        self.assertEqual(self.cache.grades_of_person('anna')['r1']['given'], CombinedGrade(8))
+
+        # same mtime, different size
+        mtime_ns = os.stat(filename).st_mtime_ns
+        self.write('anna', 'r1', '8+1/10')
+        os.utime(filename, ns=(mtime_ns, mtime_ns))
+        self.cache.sync(['anna'], ['r1'])
+        self.assertEqual(self.cache.grades_of_person('anna')['r1']['given'], CombinedGrade(8, 1))
+
+    def test_deleted_file(self):
+        self.write('anna', 'r1', '7/10')
+        filename = self.write('anna', 'r2', '5/10')
+        self.cache.sync(['anna'], ['r1', 'r2'])
+        os.unlink(filename)
+        self.cache.sync(['anna'], ['r1', 'r2'])
+        self.assertEqual(list(self.cache.grades_of_person('anna')), ['r1'])
+        self.assertEqual(len(self.cache.all_grades()), 1)
+
+    def test_without_result(self):
+        self.write('anna', 'r1', '7/10')
+        os.makedirs(os.path.join('bert', 'r1'))
+        with open(os.path.join('bert', 'r1', 'grading.org'), 'w') as stream:
+            stream.write(GRADING_TEMPLATE)
+        with redirect_stdout(StringIO()) as output:
+            self.cache.sync(['anna', 'bert'], ['r1'])
+            self.cache.sync(['anna', 'bert'], ['r1'])
+        self.assertEqual(output.getvalue().count('bert'), 1)
+        self.assertEqual(self.cache.grades_of_person('bert'), {})
+        self.assertEqual(list(self.cache.grade_sums()), ['anna'])
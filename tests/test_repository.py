@@ -0,0 +1,47 @@
+import os
+import shutil
+import subprocess
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipUnless
+
+from repository import GitRepository
+
+
+@skipUnless(shutil.which('git'), "git not installed")
+class GitRepositoryTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.path = self.tmp.name
+        self.git('init', '-q')
+        self.git('config', 'user.name', 'Tester')
+        self.git('config', 'user.email', 'tester@example.org')
+        self.repository = GitRepository(self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def git(self, *args):
+        return subprocess.run(('git',) + args, cwd=self.path, check=True,
+                              stdout=subprocess.PIPE).stdout.decode()
+
+    def write(self, name, content):
+        os.makedirs(os.path.join(self.path, os.path.dirname(name)), exist_ok=True)
+        with open(os.path.join(self.path, name), 'w') as stream:
+            stream.write(content)
+
+    def test_staging(self):
+        with self.repository.staging():
+            for name in ('anna/r1/grading.org', 'bert/r1/grading.org', 'odd name\n.org'):
+                self.write(name, name)
+                self.repository.stage(name)
+            self.assertEqual(self.git('diff', '--cached', '--name-only'), '')
+        self.assertEqual(len(self.git('diff', '--cached', '--name-only', '-z').split('\0')), 4)
+
+    def test_commit_tag(self):
+        self.write('anna/r1/grading.org', 'a/10')
+        self.repository.stage('anna/r1/grading.org')
+        self.assertTrue(self.repository.commit("Close round r1"))
+        self.assertTrue(self.repository.tag('r1'))
+
+        self.write('anna/r1/grading.org', 'changed')
+        self.assertEqual(self.git('show', 'r1:anna/r1/grading.org'), 'a/10')
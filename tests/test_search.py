@@ -0,0 +1,56 @@
+import os
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from mail import MailIndex
+from search import SearchIndex, tokenize
+
+
+def sample_mail(sender, subject, body, filename):
+    message = MIMEMultipart()
+    message['From'] = sender
+    message['Subject'] = subject
+    message.attach(MIMEText(body))
+    attachment = MIMEApplication(b'print("hallo")')
+    attachment.add_header('Content-Disposition', 'attachment', filename=filename)
+    message.attach(attachment)
+    return message.as_bytes()
+
+
+class TokenizeTestCase(TestCase):
+    def test_tokenize(self):
+        self.assertEqual(tokenize("Übung 03: uebung03.py"), {'übung', '03', 'uebung03', 'py'})
+
+
+class SearchIndexTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.mailbox = os.path.join(self.tmp.name, 'Inbox')
+        with open(self.mailbox, 'wb') as desc:
+            desc.write(b"From - Mon Oct 10 16:40:28 2016\n")
+            desc.write(sample_mail("Anna <anna@example.org>", "=?UTF-8?B?w5xidW5nIDM=?=",
+                                   "Meine Abgabe", "uebung03.py"))
+            desc.write(b"\nFrom - Tue Oct 11 09:00:00 2016\n")
+            desc.write(sample_mail("Bert <bert@example.org>", "Abgabe", "Hallo", "uebung04.py"))
+        self.mails = MailIndex(self.mailbox, os.path.join(self.tmp.name, '.grade-index'))
+        self.mails.update()
+        self.index = SearchIndex(os.path.join(self.tmp.name, '.grade-search'))
+        self.index.update(self.mails.mails, self.mailbox)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_search(self):
+        self.assertEqual(len(self.index.search('abgabe')), 2)
+        self.assertEqual(len(self.index.search('abgabe', 'anna')), 1)
+        self.assertEqual(len(self.index.search('übung')), 1)
+        self.assertEqual(len(self.index.search('uebung03.py')), 1)
+        self.assertEqual(len(self.index.search('uebung05.py')), 0)
+
+    def test_incremental(self):
+        index = SearchIndex(self.index.filename)
+        self.assertEqual(index.postings, self.index.postings)
+        self.assertEqual(index.update(self.mails.mails, self.mailbox), 0)
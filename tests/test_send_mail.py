@@ -0,0 +1,163 @@
+import json
+import os
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+from email.policy import default
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from config import GLOBAL_FOLDER_NAME, GLOBAL_FILENAME, GLOBAL_MAIL_NAME, GRADING_FILENAME, \
+    GradingConfig
+from send_mail import SENT_JOURNAL_NAME, DeliveryJournal, RoundMessageBuilder, flush_outbox, \
+    outbox_folder, render_round, send_round
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of SMTP to accept mails without authentication"""
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost")
+        for line in self.rfile:
+            command = line.split()[0].upper() if line.strip() else b''
+            if command == b'EHLO':
+                self.reply("250 localhost")
+            elif command == b'DATA':
+                self.reply("354 go ahead")
+                lines = []
+                for data in self.rfile:
+                    if data == b'.\r\n':
+                        break
+                    lines.append(data[1:] if data.startswith(b'.') else data)
+                self.server.messages.append(b''.join(lines))
+                self.reply("250 ok")
+            elif command == b'QUIT':
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeSMTPHandler)
+        self.connections = 0
+        self.messages = []
+
+
+class SendRoundTestCase(TestCase):
+    persons = ('anna', 'bert', 'carl')
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+        self.config = GradingConfig()
+        self.config.create_sample_config()
+        for person in self.persons:
+            self.config.add_person(person, '{}@example.org'.format(person))
+            self.write(os.path.join(person, 'r1', GRADING_FILENAME), "a/10\n")
+        for name in (GLOBAL_MAIL_NAME, GLOBAL_FILENAME):
+            self.write(os.path.join(GLOBAL_FOLDER_NAME, 'r1', name), "Hallo\n")
+
+        self.server = FakeSMTPServer()
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    @staticmethod
+    def write(filename, content):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as stream:
+            stream.write(content)
+
+    def send_round(self):
+        with patch('send_mail.config', self.config):
+            send_round('r1', jobs=2, rate=0, host='127.0.0.1', port=self.server.server_address[1],
+                       starttls=False, credentials=False)
+
+    def test_send_round(self):
+        self.send_round()
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertLessEqual(self.server.connections, 2)
+        self.assertTrue(all(b'X-Grading-Round: r1' in message for message in self.server.messages))
+
+    def test_resume(self):
+        DeliveryJournal(os.path.join(GLOBAL_FOLDER_NAME, 'r1', SENT_JOURNAL_NAME)).record('anna')
+        self.send_round()
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertFalse(any(b'anna@' in message for message in self.server.messages))
+
+        self.send_round()
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_builder(self):
+        self.write(os.path.join('anna', 'r1', 'fixed', 'solution.py'), "print('ä')\n")
+        with open(os.path.join('anna', 'r1', 'fixed', 'data.bin'), 'wb') as stream:
+            stream.write(bytes(range(256)) * 1000)
+
+        builder = RoundMessageBuilder('r1')
+        with builder.spool('anna', 'anna@example.org') as stream:
+            message = message_from_bytes(stream.read(), policy=default)
+        self.assertEqual(message['To'], 'anna@example.org')
+        self.assertEqual(message['X-Grading-Round'], 'r1')
+        parts = message.get_payload()
+        self.assertEqual([part.get_payload(decode=True) for part in parts[:3]],
+                         [b"Hallo\r\n", b"a/10\r\n", b"Hallo\r\n"])
+        self.assertEqual([part.get_filename() for part in parts[3:]], ['data.bin', 'solution.py'])
+        self.assertEqual(parts[3].get_payload(decode=True), bytes(range(256)) * 1000)
+        self.assertEqual(parts[4].get_content_type(), 'text/x-python')
+        self.assertEqual(parts[4].get_content(), "print('ä')\n")
+
+        shared = builder.shared_parts()
+        self.assertIs(builder.shared_parts(), shared)
+        time.sleep(0.01)
+        self.write(os.path.join(GLOBAL_FOLDER_NAME, 'r1', GLOBAL_MAIL_NAME), "Moin\n")
+        with builder.spool('bert', 'bert@example.org') as stream:
+            message = message_from_bytes(stream.read(), policy=default)
+        self.assertEqual(message.get_payload(0).get_payload(decode=True), b"Moin\r\n")
+
+    def test_send_attachment(self):
+        self.write(os.path.join('anna', 'r1', GRADING_FILENAME), ".\n.leading dot\n")
+        self.write(os.path.join('anna', 'r1', 'fixed', 'notes.txt'), "notes\n")
+        self.send_round()
+        raw = next(message for message in self.server.messages if b'To: anna@' in message)
+        message = message_from_bytes(raw, policy=default)
+        self.assertEqual(message.get_payload(1).get_content(), ".\r\n.leading dot\r\n")
+        self.assertEqual(message.get_payload(3).get_content(), "notes\n")
+
+    def test_outbox(self):
+        with patch('send_mail.config', self.config):
+            render_round('r1', jobs=2)
+        outbox = outbox_folder('r1')
+        with open(os.path.join(outbox, 'manifest.json')) as stream:
+            manifest = json.load(stream)
+        self.assertEqual(sorted(manifest['mails']), list(self.persons))
+        anna = manifest['mails']['anna']
+        self.assertEqual(os.path.getsize(os.path.join(outbox, 'new', anna['filename'])),
+                         anna['size'])
+        self.assertEqual(anna['recipients'][0], 'anna@example.org')
+        self.assertEqual(self.server.messages, [])
+
+        with patch('send_mail.config', self.config):
+            flush_outbox('r1', jobs=2, rate=0, host='127.0.0.1',
+                         port=self.server.server_address[1], starttls=False, credentials=False)
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(os.listdir(os.path.join(outbox, 'new')), [])
+        self.assertEqual(len(os.listdir(os.path.join(outbox, 'cur'))), 3)
+
+        # everything has been sent, so nothing is sent again
+        self.send_round()
+        self.assertEqual(len(self.server.messages), 3)
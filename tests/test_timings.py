@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+import timings
+
+
+class TimingsTestCase(TestCase):
+    def setUp(self):
+        timings.reset()
+
+    def tearDown(self):
+        timings.enabled = False
+        timings.reset()
+
+    def test_disabled(self):
+        with timings.span('phase'):
+            timings.count('files opened')
+        self.assertEqual(timings.report(), {'spans': {}, 'counters': {}})
+
+    def test_enabled(self):
+        timings.enable()
+        for _ in range(2):
+            with timings.span('phase'):
+                timings.count('bytes read', 10)
+        report = timings.report()
+        self.assertEqual(report['spans']['phase']['calls'], 2)
+        self.assertGreaterEqual(report['spans']['phase']['ms'], 0)
+        self.assertEqual(report['counters'], {'bytes read': 20})
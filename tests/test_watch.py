@@ -0,0 +1,78 @@
+import os
+import struct
+from contextlib import redirect_stdout
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from mail import MailIndex
+from watch import _event_names, iter_new_mails
+
+
+def inotify_event(name, mask=0):
+    encoded = name.encode() + b'\0' * (16 - len(name))
+    return struct.pack('iIII', 1, mask, 0, len(encoded)) + encoded
+
+
+class EventNamesTestCase(TestCase):
+    def test_event_names(self):
+        buffer = inotify_event('Prog') + inotify_event('Prog.msf')
+        self.assertEqual(list(_event_names(buffer)), ['Prog', 'Prog.msf'])
+
+
+class CompactionTestCase(TestCase):
+    def test_rewritten(self):
+        with TemporaryDirectory() as tmp:
+            mailbox = os.path.join(tmp, 'Inbox')
+            with open(mailbox, 'wb') as desc:
+                desc.write(b"From - Mon Oct 10 16:40:28 2016\nSubject: eins\n\n")
+            index = MailIndex(mailbox, os.path.join(tmp, '.grade-index'))
+            index.update()
+            self.assertFalse(index.rebuilt)
+
+            # Thunderbird writes the compacted folder to a new file
+            with open(mailbox + '.new', 'wb') as desc:
+                desc.write(b"From - Tue Oct 11 09:00:00 2016\nSubject: zwei\n\nlonger\n")
+            os.replace(mailbox + '.new', mailbox)
+
+            self.assertTrue(index.update())
+            self.assertTrue(index.rebuilt)
+            self.assertEqual([mail.subject for mail in index.mails], ['zwei'])
+
+
+def mbox_entry(date, subject):
+    return "From - {}\nSubject: {}\nMessage-ID: <{}@example.org>\n\n{}\n".format(
+        date, subject, subject, subject).encode()
+
+
+class IterNewMailsTestCase(TestCase):
+    def test_new_mails(self):
+        with TemporaryDirectory() as tmp:
+            mailbox = os.path.join(tmp, 'Inbox')
+            with open(mailbox, 'wb') as desc:
+                desc.write(mbox_entry("Mon Oct 10 16:40:28 2016", 'eins'))
+                desc.write(mbox_entry("Mon Oct 10 17:00:00 2016", 'zwei'))
+
+            def changes(path, interval):
+                self.assertEqual(path, mailbox)
+                with open(mailbox, 'ab') as desc:
+                    desc.write(mbox_entry("Tue Oct 11 09:00:00 2016", 'drei'))
+                yield
+                # nothing changed
+                yield
+                # compacted without 'eins', plus a new mail
+                with open(mailbox + '.new', 'wb') as desc:
+                    desc.write(mbox_entry("Mon Oct 10 17:00:00 2016", 'zwei'))
+                    desc.write(mbox_entry("Tue Oct 11 09:00:00 2016", 'drei'))
+                    desc.write(mbox_entry("Wed Oct 12 10:00:00 2016", 'vier'))
+                os.replace(mailbox + '.new', mailbox)
+                yield
+
+            with patch('mail.configured_mailboxes', return_value=[mailbox]), \
+                    patch('watch.iter_changes', changes), redirect_stdout(StringIO()) as output:
+                batches = [[(i, mail.subject) for i, mail in new_mails] for new_mails
+                           in iter_new_mails(os.path.join(tmp, '.grade-index'))]
+
+        self.assertEqual(batches, [[(2, 'drei')], [(2, 'vier')]])
+        self.assertIn("reindexed", output.getvalue())
@@ -0,0 +1,113 @@
+"""
+
+timings.py
+~~~~~~~~~~
+
+Lightweight spans and counters to see where the time of a command
+goes.  Both are no-ops until :py:func:`enable` is called.
+
+© Lukas Juhrich.
+
+"""
+import json
+import threading
+import time
+from collections import defaultdict
+
+enabled = False
+
+_lock = threading.Lock()
+# name -> [calls, seconds]
+_spans = defaultdict(lambda: [0, 0.0])
+_counters = defaultdict(int)
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        with _lock:
+            entry = _spans[self.name]
+            entry[0] += 1
+            entry[1] += elapsed
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """Measure the wall time of a ``with`` block under ``name``
+
+    Spans of the same name add up, also across threads.
+    """
+    return _Span(name) if enabled else _NO_SPAN
+
+
+def count(name, amount=1):
+    """Add ``amount`` to the counter ``name``"""
+    if enabled:
+        with _lock:
+            _counters[name] += amount
+
+
+def enable():
+    global enabled  # pylint: disable=global-statement
+    enabled = True
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def report():
+    """Return the spans and counters recorded so far
+
+    :returns: A dict with ``'spans'`` mapping names to ``{'calls',
+        'ms'}`` and ``'counters'`` mapping names to numbers
+    :rtype: dict
+    """
+    with _lock:
+        return {
+            'spans': {name: {'calls': calls, 'ms': seconds * 1000}
+                      for name, (calls, seconds) in sorted(_spans.items())},
+            'counters': dict(sorted(_counters.items())),
+        }
+
+
+def print_summary(stream=None):
+    """Print the spans, slowest first, and the counters as a table"""
+    data = report()
+    print("{: <32}{: >8}{: >12}".format("span", "calls", "ms"), file=stream)
+    for name, entry in sorted(data['spans'].items(), key=lambda item: -item[1]['ms']):
+        print("{: <32}{: >8}{: >12.1f}".format(name, entry['calls'], entry['ms']), file=stream)
+    if data['counters']:
+        print(file=stream)
+        print("{: <32}{: >20}".format("counter", "value"), file=stream)
+        for name, value in data['counters'].items():
+            print("{: <32}{: >20}".format(name, value), file=stream)
+
+
+def write_json(filename):
+    """Write :py:func:`report` as JSON"""
+    with open(filename, 'w') as stream:
+        json.dump(report(), stream, indent=2)
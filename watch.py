@@ -0,0 +1,153 @@
+"""
+
+watch.py
+~~~~~~~~
+
+© Lukas Juhrich.
+
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from mail import INDEX_FILENAME, MailSources, mail_key
+
+
+POLL_INTERVAL = 2
+# Wait for this long after a change before reading, so that a mail
+# being written by Thunderbird is read as a whole.
+SETTLE_TIME = 0.5
+# Check the mailbox regularly even with inotify, in case an event
+# has been missed.
+INOTIFY_TIMEOUT = 60
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+_inotify_event = struct.Struct('iIII')
+
+
+def _event_names(buffer):
+    """Extract the filenames of a buffer of ``inotify_event`` structs"""
+    offset = 0
+    while offset < len(buffer):
+        _, _, _, length = _inotify_event.unpack_from(buffer, offset)
+        offset += _inotify_event.size
+        yield os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+        offset += length
+
+
+def _init_inotify(directory):
+    """Watch a directory using inotify
+
+    :returns: The inotify file descriptor
+    :raises OSError: If inotify is not available
+    """
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    try:
+        init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except AttributeError:
+        raise OSError("inotify not available")
+
+    fd = init(os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    if add_watch(fd, os.fsencode(directory), INOTIFY_MASK) < 0:
+        errno = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(errno, "inotify_add_watch failed")
+    return fd
+
+
+def _wait_readable(fd, timeout):
+    return bool(select.select([fd], [], [], timeout)[0])
+
+
+def iter_inotify_changes(path):
+    """Yield whenever the file at ``path`` has been written or replaced
+
+    The directory is watched instead of the file itself, so that a
+    file replaced by a rename is noticed as well.
+
+    :raises OSError: If inotify is not available
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    fd = _init_inotify(directory)
+    try:
+        while True:
+            changed = False
+            timeout = INOTIFY_TIMEOUT
+            while _wait_readable(fd, timeout):
+                changed |= name in _event_names(os.read(fd, 64 * 1024))
+                if changed:
+                    timeout = SETTLE_TIME
+            if changed or timeout == INOTIFY_TIMEOUT:
+                yield
+    finally:
+        os.close(fd)
+
+
+def iter_polled_changes(path, interval=POLL_INTERVAL):
+    """Yield every ``interval`` seconds
+
+    Checking whether ``path`` actually changed is left to the caller,
+    so it may as well be a list of paths.
+    """
+    while True:
+        time.sleep(interval)
+        yield
+
+
+def iter_changes(path, interval=POLL_INTERVAL):
+    """Yield whenever the file at ``path`` may have changed
+
+    Use inotify on Linux and fall back to polling every ``interval``
+    seconds.
+    """
+    try:
+        yield from iter_inotify_changes(path)
+    except OSError:
+        print("inotify not available, polling every {} seconds.".format(interval))
+        yield from iter_polled_changes(path, interval)
+
+
+def iter_new_mails(index_filename=INDEX_FILENAME, interval=POLL_INTERVAL):
+    """Wait for new mails and yield them in batches
+
+    Every change of the mailboxes is handled by
+    :py:meth:`MailSources.update`, which only reads the appended region
+    of an mbox and reindexes a compacted one from scratch.  Mails
+    already seen are not yielded again, even after reindexing.
+
+    A single mbox is watched using :py:func:`iter_changes`, several
+    mailboxes or a Maildir are polled.
+
+    :returns: An iterator over lists of ``(index, mail)`` pairs
+    """
+    sources = MailSources(index_filename=index_filename)
+    sources.update()
+    seen = {mail_key(mail) for mail in sources.iter_mails()}
+
+    paths = sources.paths
+    if len(paths) == 1 and os.path.isfile(paths[0]):
+        changes = iter_changes(paths[0], interval)
+    else:
+        changes = iter_polled_changes(paths, interval)
+
+    for _ in changes:
+        if not sources.update():
+            continue
+        if sources.rebuilt:
+            print("Mailbox has been rewritten, reindexed.")
+
+        new_mails = [(i, mail) for i, mail in enumerate(sources.iter_mails())
+                     if mail_key(mail) not in seen]
+        seen.update(mail_key(mail) for _, mail in new_mails)
+        if new_mails:
+            yield new_mails